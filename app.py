@@ -1,40 +1,439 @@
+import collections
+import hashlib
+import importlib
+import inspect
 import io
+import json
+import math
+import multiprocessing
 import os
+import re
 import shutil
+import signal
+import struct
+import subprocess
 import tempfile
+import time
+import uuid
 import zipfile
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from xml.etree import ElementTree
 
-import fitz  # PyMuPDF
-import ghostscript
-import openpyxl
 from flask import (
     Flask,
+    Request,
+    Response,
     jsonify,
     render_template_string,
     request,
     send_file,
 )
-from pdf2docx import Converter
-from pdf2docx.converter import ConversionException
-from PIL import Image
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import ClientDisconnected
 from werkzeug.utils import secure_filename
 
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos nos uploads em partes
+    fcntl = None
+
+
+class LocalPDFRequest(Request):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._spooled_paths = []
+
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        # Uploads pequenos são lidos direto da memória pelos conversores; os
+        # grandes vão para um arquivo nomeado, aberto no lugar sem nova cópia
+        if (
+            total_content_length is not None
+            and total_content_length <= app.config["UPLOAD_SPOOL_THRESHOLD"]
+        ):
+            return io.BytesIO()
+        # Sem delete=True: no Windows um arquivo temporário apagado ao fechar
+        # não pode ser reaberto pelo nome (fitz, PIL, gs); close() o remove
+        stream = tempfile.NamedTemporaryFile("wb+", delete=False)
+        self._spooled_paths.append(stream.name)
+        return stream
+
+    def close(self):
+        super().close()
+        for path in self._spooled_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._spooled_paths.clear()
+
+
 app = Flask(__name__)
+app.request_class = LocalPDFRequest
 app.config["MAX_CONTENT_LENGTH"] = 100 * 1024 * 1024  # 100MB max
 app.config["UPLOAD_FOLDER"] = "uploads"
+# Uploads em partes (/uploads): tamanho máximo e expiração sem atividade
+app.config["UPLOAD_MAX_BYTES"] = 4 * 1024 * 1024 * 1024
+app.config["UPLOAD_TTL"] = 24 * 60 * 60  # segundos
+# Pré-visualização de páginas dos uploads: documentos abertos e bytes de
+# imagens renderizadas mantidos em LRU, por processo
+app.config["PREVIEW_MAX_DOCUMENTS"] = 8
+app.config["PREVIEW_CACHE_BYTES"] = 64 * 1024 * 1024
+app.config["PREVIEW_MAX_WIDTH"] = 2048  # pixels
+# Requisições até este tamanho ficam em memória; acima, vão direto para disco
+app.config["UPLOAD_SPOOL_THRESHOLD"] = 16 * 1024 * 1024
 app.config["OUTPUT_FOLDER"] = "outputs"
+app.config["JOB_FOLDER"] = os.path.join(app.config["OUTPUT_FOLDER"], "jobs")
+# Processos dedicados às ferramentas pesadas e às leves no modo assíncrono
+app.config["JOB_HEAVY_WORKERS"] = max(1, (os.cpu_count() or 2) - 1)
+app.config["JOB_LIGHT_WORKERS"] = 1
+# Custo estimado (ver estimate_cost) a partir do qual uma ferramenta leve vai
+# para o pool das pesadas
+app.config["JOB_HEAVY_COST"] = 256
+app.config["JOB_RESULT_TTL"] = 60 * 60  # segundos até o resultado expirar
+# Jobs parados em queued/running (worker derrubado no meio) expiram após
+app.config["JOB_STALE_TTL"] = 24 * 60 * 60
+# Intervalo mínimo entre varreduras da pasta de jobs (segundos)
+app.config["JOB_PURGE_INTERVAL"] = 60
+app.config["CACHE_FOLDER"] = os.path.join(app.config["OUTPUT_FOLDER"], "cache")
+app.config["CACHE_MAX_BYTES"] = 1024 * 1024 * 1024  # 0 desativa o cache
+# Processos do modo batch (batch=1), cada um convertendo um arquivo inteiro
+app.config["BATCH_WORKERS"] = os.cpu_count() or 1
+# Processos usados para dividir o trabalho de um único arquivo (ex.: páginas)
+app.config["PARALLEL_WORKERS"] = os.cpu_count() or 1
+# Conversões Ghostscript simultâneas (um processo gs isolado por arquivo)
+app.config["GHOSTSCRIPT_WORKERS"] = os.cpu_count() or 1
+app.config["GHOSTSCRIPT_TIMEOUT"] = 300  # segundos por arquivo
+app.config["PDF_TO_WORD_TIMEOUT"] = 600  # segundos por conversão
+# Pixels de uma página renderizada de uma vez (3 bytes cada, em RGB). Acima
+# disso a página é reduzida ou, em PNG, renderizada em faixas
+app.config["RENDER_MAX_PIXELS"] = 40 * 1000 * 1000
+# Tamanho máximo da imagem em faixas; acima dele a página também é reduzida
+app.config["RENDER_MAX_TILED_PIXELS"] = 1000 * 1000 * 1000
+# Servidor de produção (server.py): cada worker tem os próprios pools acima
+app.config["SERVER_BIND"] = "0.0.0.0:5000"
+app.config["SERVER_WORKERS"] = 2
+app.config["SERVER_THREADS"] = 4
+app.config["SERVER_MAX_REQUESTS"] = 500  # reciclagem do worker; 0 desativa
+app.config["SERVER_MAX_RSS"] = 1024 * 1024 * 1024  # bytes por worker; 0 desativa
+app.config["SERVER_GRACEFUL_TIMEOUT"] = 120  # segundos para concluir o que já rodava
+# Segundos sem heartbeat até o mestre matar o worker: chamadas longas do MuPDF
+# seguram o GIL e atrasam o heartbeat da thread principal
+app.config["SERVER_TIMEOUT"] = 300
+# Controle de admissão de /convert: orçamento do custo estimado (≈ MB de pico
+# de memória) das conversões simultâneas de cada processo; 0 desativa
+app.config["ADMISSION_BUDGET"] = 1024
+app.config["ADMISSION_QUEUE_TIMEOUT"] = 30  # segundos na fila antes do 429
+app.config["ADMISSION_MAX_QUEUE"] = 16  # requisições na fila; além disso, 429
+# Ferramentas cujas bibliotecas o server.py importa antes do fork: "all", ""
+# ou nomes separados por vírgula (réplicas de uma ferramenta só)
+app.config["PRELOAD_TOOLS"] = "all"
+# Sobrescreve as opções acima via ambiente, ex.: LOCALPDF_JOB_HEAVY_WORKERS=4
+app.config.from_prefixed_env("LOCALPDF")
 
 # Criar diretórios se não existirem
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 os.makedirs(app.config["OUTPUT_FOLDER"], exist_ok=True)
+os.makedirs(app.config["JOB_FOLDER"], exist_ok=True)
+os.makedirs(app.config["CACHE_FOLDER"], exist_ok=True)
+
+
+def allowed_file(filename, extensions):
+    return "." in filename and filename.rsplit(".", 1)[1].lower() in extensions
+
+
+def upload_source(file, temp_dir):
+    """
+    Devolve o conteúdo do upload como bytes quando ele está em memória, ou o
+    caminho do arquivo quando ele já está em disco. Só uploads grandes que não
+    estejam em um arquivo nomeado são gravados em temp_dir.
+    """
+    stream = file.stream
+    name = getattr(stream, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        stream.flush()
+        return name
+
+    if upload_size(file) <= app.config["UPLOAD_SPOOL_THRESHOLD"]:
+        stream.seek(0)
+        data = stream.read()
+        stream.seek(0)
+        return data
+
+    path = os.path.join(temp_dir, secure_filename(file.filename))
+    file.save(path)
+    return path
+
+
+def upload_size(file):
+    stream = file.stream
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+
+def upload_path(file, temp_dir):
+    """Caminho em disco do upload, para ferramentas que só leem arquivos."""
+    source = upload_source(file, temp_dir)
+    if isinstance(source, str):
+        return source
+    path = os.path.join(temp_dir, secure_filename(file.filename))
+    with open(path, "wb") as f:
+        f.write(source)
+    return path
+
+
+def as_file(source):
+    """Caminho ou objeto de arquivo em memória, aceito por PIL e python-docx."""
+    return source if isinstance(source, str) else io.BytesIO(source)
+
+
+def open_pdf(source):
+    import fitz  # PyMuPDF
+
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def parse_page_ranges(spec, page_count):
+    """
+    Converte uma especificação como "1-3,5,8-" em índices de página (base 0).
+    Especificação vazia seleciona todas as páginas.
+    """
+    if not spec or not spec.strip():
+        return list(range(page_count))
+
+    pages = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                start, end = part.split("-", 1)
+                start = int(start) if start.strip() else 1
+                end = int(end) if end.strip() else page_count
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise ValueError(f"Intervalo de páginas inválido: {part}") from None
+        if start < 1 or end > page_count or start > end:
+            raise ValueError(
+                f"Intervalo de páginas fora do documento ({page_count} páginas): {part}"
+            )
+        pages.extend(range(start - 1, end))
+    return pages
+
+
+def int_option(options, name, default, minimum=None, maximum=None):
+    """Lê uma opção inteira do formulário, limitada ao intervalo informado."""
+    value = options.get(name)
+    if value is None or str(value).strip() == "":
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"Valor inválido para {name}: {value}") from None
+    if minimum is not None:
+        value = max(value, minimum)
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
+def bool_option(options, name):
+    """Lê uma opção liga/desliga do formulário ("1", "true" ou "on")."""
+    return str(options.get(name) or "").strip().lower() in ("1", "true", "on")
+
+
+def chunk_list(items, count):
+    """Divide items em até count blocos contíguos, preservando a ordem."""
+    count = max(1, min(count, len(items)))
+    size, extra = divmod(len(items), count)
+    chunks, start = [], 0
+    for idx in range(count):
+        end = start + size + (1 if idx < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+# Pools de processos/threads deste processo, criados no primeiro uso
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(name, factory, **kwargs):
+    """
+    Devolve o pool name, criando-o com factory(**kwargs) se ainda não existir.
+    A criação é feita sob lock: as threads de um worker que usam o pool ao
+    mesmo tempo pela primeira vez não criam (e abandonam) pools duplicados.
+    """
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = factory(**kwargs)
+        return pool
+
+
+def _discard_pool(name, pool):
+    """Descarta um pool quebrado (ex.: worker morto por OOM); o próximo uso recria."""
+    with _pools_lock:
+        if _pools.get(name) is pool:
+            del _pools[name]
+
+
+def _parallel_pool():
+    return _get_pool(
+        "parallel", ProcessPoolExecutor, max_workers=app.config["PARALLEL_WORKERS"]
+    )
+
+
+def parallel_map(func, tasks):
+    """
+    Executa func(task) para cada tarefa em processos separados e devolve os
+    resultados na ordem das tarefas. Com um único worker roda no próprio processo.
+    """
+    tasks = list(tasks)
+    workers = min(app.config["PARALLEL_WORKERS"], len(tasks))
+    if workers <= 1:
+        return [func(task) for task in tasks]
+    pool = _parallel_pool()
+    try:
+        return list(pool.map(func, tasks))
+    except BrokenProcessPool:
+        _discard_pool("parallel", pool)
+        raise
+
+
+def parallel_imap(func, tasks):
+    """
+    Como parallel_map, mas entrega os resultados (na ordem das tarefas) à
+    medida que ficam prontos, com até 2x PARALLEL_WORKERS tarefas em andamento.
+    """
+    tasks = list(tasks)
+    workers = min(app.config["PARALLEL_WORKERS"], len(tasks))
+    if workers <= 1:
+        for task in tasks:
+            yield func(task)
+        return
+    pool = _parallel_pool()
+    pending = collections.deque()
+    try:
+        for task in tasks:
+            pending.append(pool.submit(func, task))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    except BrokenProcessPool:
+        _discard_pool("parallel", pool)
+        raise
+    finally:
+        # Cliente desconectado: descarta o que ainda não começou
+        for future in pending:
+            future.cancel()
+
+
+def _reset_pools_after_fork():
+    # Pools herdados do processo pai não funcionam no filho; o lock pode ter
+    # sido copiado ocupado por outra thread do pai
+    global _pools_lock
+    _pools_lock = threading.Lock()
+    _pools.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
+def shutdown_pools():
+    """
+    Encerra os pools deste processo na parada do worker: jobs ainda na fila
+    são cancelados e os que já estão rodando terminam antes do retorno.
+    """
+    with _pools_lock:
+        pools = dict(_pools)
+        _pools.clear()
+    for name, pool in pools.items():
+        pool.shutdown(wait=True, cancel_futures=name.startswith("job-"))
+
+
+# Ferramentas de /convert, registradas com @tool junto de cada conversor
+TOOLS = {}
+
+
+def tool(
+    name, extensions, modules=(), multiple=False, heavy=False, cost=None, stream=None
+):
+    """
+    Registra o conversor como ferramenta de /convert. Ele recebe a lista de
+    arquivos (multiple=True) ou só o primeiro, o temp_dir e as opções.
+
+    extensions: extensões aceitas nos uploads.
+    modules: bibliotecas pesadas que o conversor importa no primeiro uso;
+    preload_tools() as importa antes, se configurado.
+    heavy: no modo assíncrono, roda no pool das ferramentas demoradas.
+    cost: função (stats, options) que estima o custo da conversão, em MB de
+    pico de memória aproximados, a partir de preflight(); padrão linear_cost().
+    stream: função com os mesmos argumentos do conversor que devolve (nome,
+    mimetype, iterador de bytes); com ela, /convert síncrono envia o resultado
+    enquanto converte, sem passar pelo disco nem pelo cache.
+    """
 
-ALLOWED_EXTENSIONS = {"pdf", "docx", "txt", "xlsx", "jpg", "jpeg", "png"}
+    def register(func):
+        TOOLS[name] = {
+            "func": func,
+            "extensions": frozenset(extensions),
+            "modules": tuple(modules),
+            "multiple": multiple,
+            "heavy": heavy,
+            "cost": cost or linear_cost(),
+            "stream": stream,
+        }
+        return func
+
+    return register
+
+
+def linear_cost(base=16, per_mb=2, per_page=0, per_image=0):
+    """Custo fixo mais pesos por MB, página e imagem dos arquivos enviados."""
 
+    def cost(stats, options):
+        return (
+            base
+            + per_mb * stats["mb"]
+            + per_page * stats["pages"]
+            + per_image * stats["images"]
+        )
+
+    return cost
 
-def allowed_file(filename):
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def preload_tools(names):
+    """
+    Importa as bibliotecas das ferramentas indicadas (lista ou texto separado
+    por vírgulas; "all" para todas), para que o primeiro uso não pague o import.
+    """
+    if isinstance(names, str):
+        if names.strip().lower() == "all":
+            names = list(TOOLS)
+        else:
+            names = [name.strip() for name in names.split(",") if name.strip()]
+    for name in names:
+        if name not in TOOLS:
+            raise ValueError(f"Ferramenta não suportada: {name}")
+        for module in TOOLS[name]["modules"]:
+            importlib.import_module(module)
 
 
 # Template HTML
@@ -136,6 +535,10 @@ HTML_TEMPLATE = """
                     <h3>🔄 PDF para Word</h3>
                     <p>Converta documentos PDF para Word (.docx) editável</p>
                 </div>
+                <div class="tool-card" onclick="showTool('pdf-to-text')">
+                    <h3>📃 PDF para Texto</h3>
+                    <p>Extraia o texto das páginas do PDF (.txt)</p>
+                </div>
             </div>
         </div>
 
@@ -245,6 +648,12 @@ HTML_TEMPLATE = """
                 description: 'Converta seus documentos PDF para Word (.docx) editável',
                 accept: '.pdf',
                 multiple: false
+            },
+            'pdf-to-text': {
+                title: '📃 PDF para Texto',
+                description: 'Extraia o texto de todas as páginas do PDF em um arquivo .txt',
+                accept: '.pdf',
+                multiple: false
             }
         };
 
@@ -389,447 +798,3243 @@ def index():
     return render_template_string(HTML_TEMPLATE)
 
 
-def excel_to_pdf(file, temp_dir):
-    xlsx_path = os.path.join(temp_dir, secure_filename(file.filename))
-    file.save(xlsx_path)
+def merge_segments(segments, pdf_path):
+    """
+    Une em ordem os PDFs parciais gerados pelos workers e os remove. O primeiro
+    segmento vira a saída e os demais são acrescentados um a um com salvamento
+    incremental: só as páginas do segmento da vez ficam em memória.
+    """
+    import fitz  # PyMuPDF
+
+    os.replace(segments[0], pdf_path)
+    for segment in segments[1:]:
+        merged_doc = fitz.open(pdf_path)
+        segment_doc = fitz.open(segment)
+        merged_doc.insert_pdf(segment_doc)
+        segment_doc.close()
+        merged_doc.saveIncr()
+        merged_doc.close()
+        os.remove(segment)
+    merged_doc = fitz.open(pdf_path)
+    metrics.add_pages(len(merged_doc))
+    merged_doc.close()
+
+
+# Páginas por segmento: o ReportLab guarda as páginas em memória até o save()
+EXCEL_SEGMENT_PAGES = 200
+
+
+def _open_workbook(workbook_file):
+    # openpyxl recusa caminhos sem extensão .xlsx; recebe sempre um arquivo
+    # aberto, que workbook.close() não fecha. read_only + data_only lê as
+    # linhas em streaming, sem criar células
+    import openpyxl
+
+    return openpyxl.load_workbook(workbook_file, read_only=True, data_only=True)
+
+
+def _workbook_sheet_names(source):
+    """
+    Lê só o xl/workbook.xml: abrir o workbook inteiro percorreria todas as abas
+    quando o arquivo não traz as dimensões de cada uma.
+    """
+    with zipfile.ZipFile(as_file(source)) as archive:
+        root = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    return [
+        sheet.get("name")
+        for sheet in root.iter()
+        if sheet.tag.rsplit("}", 1)[-1] == "sheet"
+    ]
+
+
+@tool(
+    "excel-to-pdf",
+    extensions={"xlsx"},
+    modules=("openpyxl", "fitz", "reportlab.pdfgen.canvas", "layout"),
+    heavy=True,
+    # O xlsx é um zip de XML: cada MB enviado vira bem mais em memória
+    cost=linear_cost(32, per_mb=20),
+)
+def excel_to_pdf(file, temp_dir, options=None):
+    """
+    Converte a planilha para PDF com memória constante no número de linhas:
+    as linhas são lidas em streaming e as páginas gravadas em segmentos.
+    Cada aba é renderizada em paralelo e os segmentos são unidos em ordem.
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    from layout import TextWriter
 
+    source = upload_source(file, temp_dir)
     pdf_path = os.path.join(temp_dir, "excel_to_pdf.pdf")
-    c = canvas.Canvas(pdf_path, pagesize=letter)
-    width, height = letter
-    y_position = height - 50
-
-    try:
-        workbook = openpyxl.load_workbook(xlsx_path)
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            c.setFont("Helvetica", 10)
-            c.drawString(50, y_position, f"--- Planilha: {sheet_name} ---")
-            y_position -= 20
-
-            for row_idx, row in enumerate(sheet.iter_rows()):
-                row_data = [
-                    str(cell.value) if cell.value is not None else "" for cell in row
-                ]
-                line_text = " | ".join(row_data)
-
-                # Simples quebra de linha para caber na página
-                max_line_width = int(
-                    (width - 100) / 6
-                )  # Estimativa de caracteres por linha
-                if len(line_text) > max_line_width:
-                    # Implementação mais robusta de quebra de linha seria necessária
-                    line_text = line_text[:max_line_width] + "..."
-
-                if y_position < 50:
-                    c.showPage()
-                    y_position = height - 50
-                    c.setFont("Helvetica", 10)  # Reset font after new page
-
-                c.drawString(50, y_position, line_text)
-                y_position -= 15  # Espaçamento menor para linhas de planilha
-
-            y_position -= 30  # Espaçamento entre planilhas
-            if (
-                y_position < 50 and sheet_name != workbook.sheetnames[-1]
-            ):  # Only show new page if not last sheet
-                c.showPage()
-                y_position = height - 50
 
+    try:
+        sheet_names = _workbook_sheet_names(source)
     except Exception as e:
         # Handle potential errors with Excel files
-        c.drawString(50, y_position - 20, f"Erro ao ler planilha: {e}")
         print(f"Erro ao ler planilha Excel: {e}")
-
-    c.save()
+        writer = TextWriter(lambda: canvas.Canvas(pdf_path, pagesize=letter))
+        writer.skip(20)
+        writer.write_line(f"Erro ao ler planilha: {e}")
+        writer.close()
+        return [pdf_path]
+
+    tasks = [
+        (source, sheet_name, os.path.join(temp_dir, f"sheet_{idx}"))
+        for idx, sheet_name in enumerate(sheet_names)
+    ]
+    segments = []
+    for sheet_segments in parallel_map(_render_sheet, tasks):
+        segments.extend(sheet_segments)
+
+    merge_segments(segments, pdf_path)
     return [pdf_path]
 
 
-def txt_to_pdf(file, temp_dir):
-    txt_path = os.path.join(temp_dir, secure_filename(file.filename))
-    file.save(txt_path)
+def _render_sheet(task):
+    """Renderiza uma aba em segmentos de até EXCEL_SEGMENT_PAGES páginas."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    from layout import TextWriter
 
-    pdf_path = os.path.join(temp_dir, "text_to_pdf.pdf")
-    c = canvas.Canvas(pdf_path, pagesize=letter)
-    width, height = letter
-    y_position = height - 50
+    source, sheet_name, segment_prefix = task
+    segments = []
 
-    c.setFont("Helvetica", 12)
+    def new_segment():
+        segment_path = f"{segment_prefix}_{len(segments)}.pdf"
+        segments.append(segment_path)
+        return canvas.Canvas(segment_path, pagesize=letter)
 
+    # Espaçamento menor para linhas de planilha; linhas longas são cortadas
+    writer = TextWriter(
+        new_segment, font_size=10, leading=15, max_pages=EXCEL_SEGMENT_PAGES
+    )
     try:
-        with open(txt_path, "r", encoding="utf-8") as f:
-            for line in f:
-                # Simples quebra de linha para caber na página
-                text_line = line.strip()
-                max_width_px = width - 100  # Margens de 50px de cada lado
-
-                # Estimar a largura do texto para quebrar linhas
-                # ReportLab não tem quebra automática de texto complexa por default
-                # Esta é uma estimativa MUITO simples; para algo robusto, precisaria de TextObject
-                approx_char_width_px = 7  # Média para Helvetica 12
-                chars_per_line = int(max_width_px / approx_char_width_px)
-
-                if len(text_line) > chars_per_line:
-                    # Quebra simples da linha
-                    chunks = [
-                        text_line[i : i + chars_per_line]
-                        for i in range(0, len(text_line), chars_per_line)
-                    ]
-                else:
-                    chunks = [text_line]
+        binary = open(source, "rb") if isinstance(source, str) else io.BytesIO(source)
+        with binary as workbook_file:
+            workbook = _open_workbook(workbook_file)
+            try:
+                writer.leading = 20
+                writer.write_line(f"--- Planilha: {sheet_name} ---")
+                writer.leading = 15
+
+                for row in workbook[sheet_name].iter_rows(values_only=True):
+                    writer.write_truncated(
+                        " | ".join(
+                            str(value) if value is not None else "" for value in row
+                        )
+                    )
+            finally:
+                workbook.close()
+    except Exception as e:
+        writer.skip(20)
+        writer.write_line(f"Erro ao ler planilha: {e}")
+        print(f"Erro ao ler planilha Excel: {e}")
+
+    writer.close()
+    return segments
+
+
+@tool(
+    "txt-to-pdf",
+    extensions={"txt"},
+    modules=("reportlab.pdfgen.canvas", "layout"),
+    cost=linear_cost(16, per_mb=4),
+)
+def txt_to_pdf(file, temp_dir, options=None):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
 
-                for chunk in chunks:
-                    if y_position < 50:  # Margem inferior
-                        c.showPage()
-                        y_position = height - 50
-                        c.setFont("Helvetica", 12)  # Reset font after new page
+    from layout import TextWriter
 
-                    c.drawString(50, y_position, chunk)
-                    y_position -= 15  # Espaçamento entre linhas
+    source = upload_source(file, temp_dir)
+
+    pdf_path = os.path.join(temp_dir, "text_to_pdf.pdf")
+    # Margens de 50pt de cada lado; quebra pela largura real da Helvetica 12
+    writer = TextWriter(lambda: canvas.Canvas(pdf_path, pagesize=letter))
+
+    try:
+        binary = open(source, "rb") if isinstance(source, str) else io.BytesIO(source)
+        with io.TextIOWrapper(binary, encoding="utf-8") as f:
+            for line in f:
+                writer.write_wrapped(line.strip())
 
     except Exception as e:
-        c.drawString(50, y_position - 20, f"Erro ao ler arquivo de texto: {e}")
+        writer.skip(20)
+        writer.write_line(f"Erro ao ler arquivo de texto: {e}")
         print(f"Erro ao ler arquivo de texto: {e}")
 
-    c.save()
+    writer.close()
+    metrics.add_pages(writer.pages)
     return [pdf_path]
 
 
+REQUESTS = metrics.Counter(
+    "localpdf_requests_total", "Requisições a /convert por ferramenta", ("tool",)
+)
+REQUEST_ERRORS = metrics.Counter(
+    "localpdf_request_errors_total",
+    "Requisições a /convert que falharam, por ferramenta e status HTTP",
+    ("tool", "status"),
+)
+REQUEST_LATENCY = metrics.Histogram(
+    "localpdf_request_duration_seconds",
+    "Duração total das requisições a /convert, até o fim do envio",
+    ("tool",),
+)
+STAGE_LATENCY = metrics.Histogram(
+    "localpdf_stage_duration_seconds",
+    "Duração de cada etapa de /convert (upload, convert, archive, send)",
+    ("tool", "stage"),
+)
+BYTES_IN = metrics.Counter(
+    "localpdf_bytes_in_total", "Bytes recebidos nos uploads", ("tool",)
+)
+BYTES_OUT = metrics.Counter(
+    "localpdf_bytes_out_total", "Bytes dos arquivos gerados", ("tool",)
+)
+PAGES = metrics.Counter(
+    "localpdf_pages_processed_total", "Páginas processadas pelos conversores", ("tool",)
+)
+INFLIGHT_REQUESTS = metrics.Gauge(
+    "localpdf_inflight_requests", "Requisições a /convert em andamento"
+)
+INFLIGHT_JOBS = metrics.Gauge(
+    "localpdf_inflight_jobs", "Jobs assíncronos na fila ou em execução", ("queue",)
+)
+metrics.Gauge(
+    "process_resident_memory_bytes",
+    "Memória residente (RSS) do processo",
+    collect=metrics.resident_memory_bytes,
+)
+
+
+class AdmissionControl:
+    """
+    Orçamento de custo das conversões em andamento neste processo. Cada
+    requisição reserva o custo estimado antes de converter: se não cabe, espera
+    na fila em ordem de chegada por até ADMISSION_QUEUE_TIMEOUT segundos; com a
+    fila cheia ou o tempo esgotado, é recusada (429). Uma conversão mais cara
+    que o orçamento inteiro roda sozinha. O orçamento é por processo: no
+    server.py, o limite do servidor é ADMISSION_BUDGET x SERVER_WORKERS.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._queue = collections.deque()
+        self.in_use = 0
+        self.running = 0
+        # Média móvel da duração das conversões, para o Retry-After
+        self._average_seconds = None
+
+    @property
+    def waiting(self):
+        return len(self._queue)
+
+    def acquire(self, cost):
+        """Reserva o custo e devolve o valor reservado, ou None se recusado."""
+        budget = app.config["ADMISSION_BUDGET"]
+        if budget <= 0:
+            return 0
+        cost = min(cost, budget)
+        deadline = time.monotonic() + app.config["ADMISSION_QUEUE_TIMEOUT"]
+        with self._condition:
+            # Com a fila vazia e orçamento livre, entra direto, sem fila
+            if not self._queue and self.in_use + cost <= budget:
+                self.in_use += cost
+                self.running += 1
+                return cost
+            # O limite da fila só vale para quem de fato precisa esperar
+            if len(self._queue) >= app.config["ADMISSION_MAX_QUEUE"]:
+                return None
+            ticket = object()
+            self._queue.append(ticket)
+            try:
+                while self._queue[0] is not ticket or self.in_use + cost > budget:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self._condition.wait(remaining)
+            finally:
+                self._queue.remove(ticket)
+                self._condition.notify_all()
+            self.in_use += cost
+            self.running += 1
+        return cost
+
+    def release(self, cost, seconds):
+        if not cost:
+            return
+        with self._condition:
+            self.in_use -= cost
+            self.running -= 1
+            if self._average_seconds is None:
+                self._average_seconds = seconds
+            else:
+                self._average_seconds = 0.8 * self._average_seconds + 0.2 * seconds
+            self._condition.notify_all()
+
+    def retry_after(self):
+        """Segundos estimados até a fila atual ser atendida."""
+        with self._condition:
+            average = self._average_seconds or 1
+            return max(
+                1, math.ceil(average * (len(self._queue) + 1) / max(1, self.running))
+            )
+
+
+ADMISSION = AdmissionControl()
+metrics.Gauge(
+    "localpdf_admission_cost_in_use",
+    "Custo estimado das conversões admitidas e em andamento",
+    collect=lambda: ADMISSION.in_use,
+)
+metrics.Gauge(
+    "localpdf_admission_waiting",
+    "Requisições na fila do controle de admissão",
+    collect=lambda: ADMISSION.waiting,
+)
+ADMISSION_REJECTED = metrics.Counter(
+    "localpdf_admission_rejected_total",
+    "Requisições recusadas com 429 pelo controle de admissão",
+    ("tool",),
+)
+
+
+def preflight(files):
+    """
+    Estatísticas baratas dos uploads para estimar o custo: tamanho em MB e,
+    nos PDFs, páginas e imagens, lidas da tabela de xref e dos dicionários
+    dos objetos, sem decodificar o conteúdo das páginas.
+    """
+    stats = {"files": len(files), "mb": 0.0, "pages": 0, "images": 0}
+    for file in files:
+        stats["mb"] += upload_size(file) / (1024 * 1024)
+        if file.filename.rsplit(".", 1)[-1].lower() == "pdf":
+            pages, images = _pdf_counts(file)
+            stats["pages"] += pages
+            stats["images"] += images
+    return stats
+
+
+def _pdf_counts(file):
+    import fitz  # PyMuPDF
+
+    stream = file.stream
+    source = getattr(stream, "name", None)
+    try:
+        if isinstance(source, str) and os.path.isfile(source):
+            stream.flush()
+            doc = fitz.open(source)
+        else:
+            stream.seek(0)
+            doc = fitz.open(stream=stream.read(), filetype="pdf")
+            stream.seek(0)
+    except Exception:
+        # Arquivo inválido: a própria ferramenta informa o erro
+        return 0, 0
+    try:
+        images = 0
+        for xref in range(1, doc.xref_length()):
+            if doc.xref_get_key(xref, "Subtype")[1] == "/Image":
+                images += 1
+        return doc.page_count, images
+    except Exception:
+        return 0, 0
+    finally:
+        doc.close()
+
+
+def estimate_cost(tool, files, options, batch=False):
+    """Custo estimado da conversão; no modo batch, dos arquivos em paralelo."""
+    cost = TOOLS[tool]["cost"]
+    if batch:
+        per_file = max(cost(preflight([file]), options) for file in files)
+        return per_file * min(app.config["BATCH_WORKERS"], len(files))
+    return cost(preflight(files), options)
+
+
+def overloaded_response(tool):
+    ADMISSION_REJECTED.inc(tool)
+    response = jsonify({"error": "Servidor ocupado, tente novamente em instantes"})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(ADMISSION.retry_after())
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    # Valores do processo que atendeu a requisição
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/convert", methods=["POST"])
 def convert():
-    if "files" not in request.files:
-        return jsonify({"error": "Nenhum arquivo enviado"}), 400
+    started = time.perf_counter()
+    INFLIGHT_REQUESTS.inc()
+    stages = {}
+    tool = None
+    try:
+        # O primeiro acesso ao formulário lê e grava o upload inteiro
+        tool = request.form.get("tool")
+        stages["upload"] = time.perf_counter() - started
+        response = app.make_response(_convert(tool, stages))
+    except BaseException:
+        _finish_convert(tool, 500, started, stages)
+        raise
+
+    send_started = time.perf_counter()
+    converted = stages.get("convert", 0)
+
+    def finish():
+        # No modo batch a conversão continua durante o envio (ver run_batch)
+        streamed = stages.get("archive", 0) + stages.get("convert", 0) - converted
+        stages["send"] = time.perf_counter() - send_started - streamed
+        _finish_convert(tool, response.status_code, started, stages)
+
+    response.call_on_close(finish)
+    return response
+
+
+def _finish_convert(tool, status, started, stages):
+    label = tool if tool in TOOLS else "unknown"
+    INFLIGHT_REQUESTS.dec()
+    REQUESTS.inc(label)
+    if status >= 400:
+        REQUEST_ERRORS.inc(label, str(status))
+    REQUEST_LATENCY.observe(time.perf_counter() - started, label)
+    for stage, seconds in stages.items():
+        STAGE_LATENCY.observe(seconds, label, stage)
+
+
+def _convert(tool, stages):
+    # Arquivos grandes podem vir de /uploads, referenciados em upload_ids
+    try:
+        uploads = open_uploads(request.form.get("upload_ids"))
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    try:
+        return _convert_files(tool, uploads, stages)
+    finally:
+        for upload in uploads:
+            upload.close()
 
+
+def _convert_files(tool, uploads, stages):
     files = request.files.getlist("files")
-    tool = request.form.get("tool")
+    if uploads:
+        files = [f for f in files if f.filename] + uploads
+    elif "files" not in request.files:
+        return jsonify({"error": "Nenhum arquivo enviado"}), 400
 
     if not files or files[0].filename == "":
         return jsonify({"error": "Nenhum arquivo selecionado"}), 400
 
+    if tool not in TOOLS:
+        return jsonify({"error": "Ferramenta não suportada"}), 400
+
     # Validação de extensão dos arquivos enviados
     for f in files:
-        if not allowed_file(f.filename):
+        if not allowed_file(f.filename, TOOLS[tool]["extensions"]):
             return jsonify({"error": f"Extensão não permitida: {f.filename}"}), 400
 
+    # Demais campos do formulário são opções da ferramenta (dpi, páginas...)
+    options = request.form.to_dict()
+    options.pop("tool", None)
+    options.pop("upload_ids", None)
+    run_async = bool_option(options, "async")
+    run_batch_mode = bool_option(options, "batch")
+    options.pop("async", None)
+    options.pop("batch", None)
+    bytes_in = sum(upload_size(f) for f in files)
+
+    if run_batch_mode and run_async:
+        return jsonify({"error": "O modo batch não pode ser usado com async"}), 400
+    # Ferramentas de vários arquivos já tratam o lote numa chamada só (e as
+    # que juntam tudo num resultado, como merge-pdf, não fazem sentido por arquivo)
+    if run_batch_mode and TOOLS[tool]["multiple"]:
+        return jsonify(
+            {"error": f"O modo batch é só para ferramentas de um arquivo: {tool}"}
+        ), 400
+
+    # Modo assíncrono: devolve o id do job na hora e processa em outro processo
+    if run_async:
+        saving = time.perf_counter()
+        job = submit_job(tool, files, options)
+        stages["upload"] += time.perf_counter() - saving
+        BYTES_IN.inc(tool, amount=bytes_in)
+        return jsonify(job), 202
+
+    # Espera a vez no orçamento de custo (ou recusa com 429) antes de converter
+    queued = time.perf_counter()
+    reserved = ADMISSION.acquire(
+        estimate_cost(tool, files, options, batch=run_batch_mode)
+    )
+    stages["queue"] = time.perf_counter() - queued
+    if reserved is None:
+        return overloaded_response(tool)
+
+    if TOOLS[tool]["stream"] is not None and not run_batch_mode:
+        return stream_tool(tool, files, options, stages, reserved, bytes_in)
+
+    if run_batch_mode:
+        temp_dir = tempfile.mkdtemp()
+        saving = time.perf_counter()
+        stages["convert"] = 0.0
+        try:
+            output_files = run_batch(tool, files, temp_dir, options, stages)
+        except BaseException:
+            ADMISSION.release(reserved, time.perf_counter() - saving)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        stages["upload"] += time.perf_counter() - saving
+        BYTES_IN.inc(tool, amount=bytes_in)
+        response = build_response(output_files, stages)
+        response.headers["X-Bytes-In"] = str(bytes_in)
+
+        # Os arquivos são convertidos enquanto o zip é enviado
+        def finish_batch():
+            ADMISSION.release(reserved, time.perf_counter() - saving)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        response.call_on_close(finish_batch)
+        return response
+
     # Criar diretório temporário
     temp_dir = tempfile.mkdtemp()
-    response = None
-    try:
-        if tool == "pdf-to-images":
-            output_files = pdf_to_images(files[0], temp_dir)
-        elif tool == "images-to-pdf":
-            output_files = images_to_pdf(files, temp_dir)
-        elif tool == "merge-pdf":
-            output_files = merge_pdfs(files, temp_dir)
-        elif tool == "split-pdf":
-            output_files = split_pdf(files[0], temp_dir)
-        elif tool == "compress-pdf":
-            output_files = compress_pdf(files[0], temp_dir)
-        elif tool == "pdf-to-pdfa":
-            output_files = pdf_to_pdfa(files, temp_dir)
-        elif tool == "word-to-pdf":
-            output_files = word_to_pdf(files, temp_dir)
-        elif tool == "excel-to-pdf":
-            output_files = excel_to_pdf(files[0], temp_dir)
-        elif tool == "txt-to-pdf":
-            output_files = txt_to_pdf(files[0], temp_dir)
-        elif tool == "pdf-to-word":
-            output_files = pdf_to_word(files[0], temp_dir)
-        else:
-            return jsonify({"error": "Ferramenta não suportada"}), 400
-
-        response = build_response(output_files, temp_dir)
-        return response
+    converting = time.perf_counter()
+    try:
+        pages = metrics.track_pages()
+        output_files = run_tool(tool, files, temp_dir, options)
+        stages["convert"] = time.perf_counter() - converting
+        bytes_out = sum(os.path.getsize(path) for path in output_files)
+        response = build_response(output_files, stages)
+        # Tamanho antes/depois, útil principalmente para compress-pdf
+        response.headers["X-Bytes-In"] = str(bytes_in)
+        response.headers["X-Bytes-Out"] = str(bytes_out)
+    except ValueError as e:
+        # Opções inválidas enviadas pelo usuário
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
         return jsonify({"error": str(e)}), 500
     finally:
-        # Diretório temporário limpo após preparar resposta (BytesIO) evitando remoção antecipada
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+        # O envio não conta: só a conversão ocupa o orçamento
+        ADMISSION.release(reserved, time.perf_counter() - converting)
 
+    BYTES_IN.inc(tool, amount=bytes_in)
+    BYTES_OUT.inc(tool, amount=bytes_out)
+    PAGES.inc(tool, amount=pages[0])
 
-def pdf_to_images(file, temp_dir):
-    pdf_path = os.path.join(temp_dir, secure_filename(file.filename))
-    file.save(pdf_path)
+    # A resposta lê os arquivos direto do disco enquanto envia; o diretório
+    # temporário só é removido quando o envio termina
+    response.call_on_close(lambda: shutil.rmtree(temp_dir, ignore_errors=True))
+    return response
 
-    doc = fitz.open(pdf_path)
-    output_files = []
 
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # 2x resolution
-        img_path = os.path.join(temp_dir, f"page_{page_num + 1}.png")
-        pix.save(img_path)
-        output_files.append(img_path)
+def stream_tool(tool, files, options, stages, reserved, bytes_in):
+    """
+    Resposta em streaming das ferramentas com stream=: o resultado vai para o
+    cliente enquanto é gerado. Erros de opções ainda viram 400; depois que o
+    envio começa, uma falha só pode interromper a resposta.
+    """
+    entry = TOOLS[tool]
+    started = time.perf_counter()
+    temp_dir = tempfile.mkdtemp()
 
-    doc.close()
+    def finish():
+        ADMISSION.release(reserved, time.perf_counter() - started)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    try:
+        pages = metrics.track_pages()
+        filename, mimetype, chunks = entry["stream"](
+            files if entry["multiple"] else files[0], temp_dir, options
+        )
+    except ValueError as e:
+        finish()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        finish()
+        return jsonify({"error": str(e)}), 500
+
+    # Só a espera pela conversão conta como etapa convert (ver convert())
+    stages["convert"] = 0.0
+    chunks = metrics.timed_iter(chunks, lambda s: stages.update(convert=s))
+
+    def generate():
+        bytes_out = 0
+        try:
+            for chunk in chunks:
+                bytes_out += len(chunk)
+                yield chunk
+        finally:
+            BYTES_IN.inc(tool, amount=bytes_in)
+            BYTES_OUT.inc(tool, amount=bytes_out)
+            PAGES.inc(tool, amount=pages[0])
+
+    response = Response(generate(), mimetype=mimetype)
+    response.headers.set("Content-Disposition", "attachment", filename=filename)
+    response.headers["X-Bytes-In"] = str(bytes_in)
+    response.call_on_close(finish)
+    return response
+
+
+def run_tool(tool, files, temp_dir, options=None):
+    """
+    Executa a ferramenta escolhida e devolve a lista de arquivos gerados.
+    Entradas e opções já processadas são servidas pelo cache de resultados.
+    """
+    options = options or {}
+    if app.config["CACHE_MAX_BYTES"] <= 0:
+        return dispatch_tool(tool, files, temp_dir, options)
+
+    key = cache_key(tool, files, options)
+    output_files = cache_get(key, temp_dir)
+    if output_files is None:
+        output_files = dispatch_tool(tool, files, temp_dir, options)
+        cache_put(key, output_files)
     return output_files
 
 
-def images_to_pdf(files, temp_dir):
-    images = []
-    for file in files:
-        img_path = os.path.join(temp_dir, secure_filename(file.filename))
-        file.save(img_path)
-        img = Image.open(img_path)
-        if img.mode != "RGB":
-            img = img.convert("RGB")
-        images.append(img)
+def dispatch_tool(tool, files, temp_dir, options):
+    entry = TOOLS.get(tool)
+    if entry is None:
+        raise ValueError(f"Ferramenta não suportada: {tool}")
+    return entry["func"](files if entry["multiple"] else files[0], temp_dir, options)
 
-    pdf_path = os.path.join(temp_dir, "images_to_pdf.pdf")
-    images[0].save(pdf_path, save_all=True, append_images=images[1:])
 
-    return [pdf_path]
+JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
 
+# Incrementar quando a saída de alguma ferramenta mudar, invalidando o cache
+CACHE_VERSION = 7
+CACHE_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Contadores deste processo; jobs e batch usam o cache nos próprios processos
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+# Tamanho do cache estimado por este processo: o que havia no disco na última
+# varredura mais o que ele guardou depois (None = ainda não varrido). O disco
+# só é varrido de novo quando a estimativa passa de CACHE_MAX_BYTES
+_cache_size = None
+# Fração de CACHE_MAX_BYTES que fica após um descarte, para que a próxima
+# varredura só aconteça depois de novos resultados somarem o restante
+CACHE_EVICT_TARGET = 0.9
 
-def merge_pdfs(files, temp_dir):
-    merged_doc = fitz.open()
 
+def cache_key(tool, files, options):
+    """Hash do conteúdo dos arquivos, do nome deles, da ferramenta e das opções."""
+    digest = hashlib.sha256()
+    header = {"version": CACHE_VERSION, "tool": tool, "options": options}
+    digest.update(json.dumps(header, sort_keys=True).encode("utf-8"))
     for file in files:
-        pdf_path = os.path.join(temp_dir, secure_filename(file.filename))
-        file.save(pdf_path)
-        doc = fitz.open(pdf_path)
-        merged_doc.insert_pdf(doc)
-        doc.close()
+        # O nome entra na chave porque define o nome dos arquivos de saída
+        digest.update(b"\0" + secure_filename(file.filename).encode("utf-8") + b"\0")
+        if isinstance(file, StoredUpload):
+            digest.update(file.sha256.encode("ascii"))
+            continue
+        file.stream.seek(0)
+        while chunk := file.stream.read(STREAM_CHUNK_SIZE):
+            digest.update(chunk)
+        file.stream.seek(0)
+    return digest.hexdigest()
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
 
-    output_path = os.path.join(temp_dir, "merged.pdf")
-    merged_doc.save(output_path)
-    merged_doc.close()
 
-    return [output_path]
+def cache_get(key, dest_dir):
+    """Copia (ou cria hard links) do resultado em cache para dest_dir."""
+    entry_dir = os.path.join(app.config["CACHE_FOLDER"], key)
+    try:
+        with open(os.path.join(entry_dir, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        output_files = []
+        for name in manifest["files"]:
+            dst = os.path.join(dest_dir, name)
+            _link_or_copy(os.path.join(entry_dir, name), dst)
+            output_files.append(dst)
+        # mtime da entrada marca o último uso (ordem do LRU)
+        os.utime(entry_dir)
+    except (OSError, ValueError, KeyError):
+        _count_cache("misses")
+        return None
+    _count_cache("hits")
+    return output_files
 
 
-def split_pdf(file, temp_dir):
-    pdf_path = os.path.join(temp_dir, secure_filename(file.filename))
-    file.save(pdf_path)
+def cache_put(key, output_files):
+    """Guarda o resultado e remove as entradas menos usadas acima do limite."""
+    size = sum(os.path.getsize(path) for path in output_files)
+    if size > app.config["CACHE_MAX_BYTES"]:
+        return
+
+    cache_dir = app.config["CACHE_FOLDER"]
+    tmp_dir = os.path.join(cache_dir, f"{key}.tmp-{uuid.uuid4().hex}")
+    os.makedirs(tmp_dir)
+    names = []
+    for path in output_files:
+        name = os.path.basename(path)
+        _link_or_copy(path, os.path.join(tmp_dir, name))
+        names.append(name)
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"files": names, "size": size}, f)
+    try:
+        # rename é atômico: leitores nunca veem uma entrada pela metade
+        os.rename(tmp_dir, os.path.join(cache_dir, key))
+    except OSError:
+        # Outro processo guardou o mesmo resultado primeiro
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+    global _cache_size
+    with _cache_lock:
+        _cache_stats["stores"] += 1
+        if _cache_size is not None:
+            _cache_size += size
+        if _cache_size is not None and _cache_size <= app.config["CACHE_MAX_BYTES"]:
+            return
+    evict_cache()
+
+
+def _count_cache(name, amount=1):
+    with _cache_lock:
+        _cache_stats[name] += amount
+
+
+def _cache_entries():
+    cache_dir = app.config["CACHE_FOLDER"]
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if not CACHE_KEY_RE.match(entry.name):
+            continue
+        try:
+            with open(os.path.join(entry.path, "manifest.json"), encoding="utf-8") as f:
+                size = json.load(f)["size"]
+            entries.append((entry.stat().st_mtime, size, entry.path))
+        except (OSError, ValueError, KeyError):
+            continue
+    return entries
 
-    doc = fitz.open(pdf_path)
-    output_files = []
 
-    for page_num in range(len(doc)):
-        new_doc = fitz.open()
-        new_doc.insert_pdf(doc, from_page=page_num, to_page=page_num)
-        output_path = os.path.join(temp_dir, f"page_{page_num + 1}.pdf")
-        new_doc.save(output_path)
-        new_doc.close()
-        output_files.append(output_path)
+def evict_cache():
+    """
+    Varre o cache e, se ele passou de CACHE_MAX_BYTES, remove as entradas
+    usadas há mais tempo até CACHE_EVICT_TARGET do limite. Outros processos
+    também gravam no cache: a varredura corrige a estimativa deste.
+    """
+    global _cache_size
+    entries = sorted(_cache_entries())
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    if total > app.config["CACHE_MAX_BYTES"]:
+        target = app.config["CACHE_MAX_BYTES"] * CACHE_EVICT_TARGET
+        for _, size, path in entries:
+            if total <= target:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            evicted += 1
+    with _cache_lock:
+        _cache_stats["evictions"] += evicted
+        _cache_size = total
+
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """
+    Entradas e bytes vêm do disco, compartilhado por todos os processos. Os
+    contadores (process) são só do processo que atendeu: não incluem os
+    acessos feitos pelos jobs assíncronos, pelo batch nem por outros workers.
+    """
+    entries = _cache_entries()
+    with _cache_lock:
+        counters = dict(_cache_stats)
+    return jsonify(
+        {
+            "process": {"pid": os.getpid(), **counters},
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": app.config["CACHE_MAX_BYTES"],
+        }
+    )
 
-    doc.close()
-    return output_files
 
+def _single_worker_init():
+    """
+    Inicializa os processos dos pools de jobs e do batch: o paralelismo já é
+    entre jobs (ou arquivos), então cada um converte sozinho, sem abrir os
+    próprios pools de PARALLEL_WORKERS e GHOSTSCRIPT_WORKERS processos.
+    """
+    app.config["PARALLEL_WORKERS"] = 1
+    app.config["GHOSTSCRIPT_WORKERS"] = 1
 
-def compress_pdf(file, temp_dir):
-    pdf_path = os.path.join(temp_dir, secure_filename(file.filename))
-    file.save(pdf_path)
 
-    doc = fitz.open(pdf_path)
-    output_path = os.path.join(temp_dir, "compressed.pdf")
-    doc.save(output_path, garbage=4, deflate=True, clean=True)
-    doc.close()
+def _get_job_pool(kind):
+    key = "JOB_HEAVY_WORKERS" if kind == "heavy" else "JOB_LIGHT_WORKERS"
+    return _get_pool(
+        f"job-{kind}",
+        ProcessPoolExecutor,
+        max_workers=app.config[key],
+        initializer=_single_worker_init,
+    )
 
-    return [output_path]
 
+def _job_dir(job_id):
+    return os.path.join(app.config["JOB_FOLDER"], job_id)
 
-def pdf_to_pdfa(files, temp_dir):
-    """Converte um ou mais PDFs para PDF/A-1b usando Ghostscript."""
-    if not isinstance(files, list):
-        files = [files]
 
-    output_files = []
+def _read_job(job_id):
+    try:
+        with open(os.path.join(_job_dir(job_id), "job.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-    for file in files:
-        input_path = os.path.join(temp_dir, secure_filename(file.filename))
-        file.save(input_path)
 
-        base_name, _ = os.path.splitext(os.path.basename(input_path))
-        output_path = os.path.join(temp_dir, f"{base_name}_pdfa.pdf")
+def _write_job(job_dir, **fields):
+    """Atualiza o job.json de forma atômica (lido por qualquer processo web)."""
+    return _update_json(os.path.join(job_dir, "job.json"), **fields)
 
-        gs_args = [
-            "gs",
-            "-dPDFA=1",
-            "-dBATCH",
-            "-dNOPAUSE",
-            "-dNOOUTERSAVE",
-            "-dUseCIEColor",
-            "-sProcessColorModel=DeviceRGB",
-            "-sDEVICE=pdfwrite",
-            "-sColorConversionStrategy=UseDeviceIndependentColor",
-            "-dPDFACompatibilityPolicy=1",
-            f"-sOutputFile={output_path}",
-            input_path,
-        ]
-        gs_args = [
-            arg.encode("utf-8") if isinstance(arg, str) else arg for arg in gs_args
-        ]
 
-        try:
-            ghostscript.Ghostscript(*gs_args)
-        except Exception as e:
-            raise RuntimeError(
-                f"Erro ao converter {file.filename} para PDF/A: {e}"
-            ) from e
+def _update_json(path, **fields):
+    data = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    data.update(fields)
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+    return data
 
-        output_files.append(output_path)
 
-    return output_files
+def _job_expired(job, now):
+    """
+    Resultado já expirado, ou job que nunca terminou (o processo que o rodava
+    morreu sem gravar o status) criado há mais de JOB_STALE_TTL segundos.
+    """
+    if job.get("expires_at"):
+        return job["expires_at"] < now
+    return job.get("created_at", 0) + app.config["JOB_STALE_TTL"] < now
+
+
+_jobs_purged_at = 0.0
+_jobs_purge_lock = threading.Lock()
 
 
-def word_to_pdf(files, temp_dir):
+def purge_expired_jobs():
     """
-    Converte um ou múltiplos arquivos DOCX para PDF
-    Se houver múltiplos arquivos, mescla todos em um único PDF
+    Remove os jobs expirados. A varredura lê o job.json de cada job, então roda
+    no máximo uma vez a cada JOB_PURGE_INTERVAL segundos por processo.
     """
-    from docx import Document
-    from reportlab.lib.pagesizes import letter
-    from reportlab.pdfgen import canvas
+    global _jobs_purged_at
+    if not _jobs_purge_lock.acquire(blocking=False):
+        return
+    try:
+        now = time.time()
+        if now - _jobs_purged_at < app.config["JOB_PURGE_INTERVAL"]:
+            return
+        _jobs_purged_at = now
+        for job_id in os.listdir(app.config["JOB_FOLDER"]):
+            if not JOB_ID_RE.match(job_id):
+                continue
+            job = _read_job(job_id)
+            if job and _job_expired(job, now):
+                shutil.rmtree(_job_dir(job_id), ignore_errors=True)
+    finally:
+        _jobs_purge_lock.release()
 
-    # Criar PDF de saída
-    pdf_path = os.path.join(temp_dir, "word_to_pdf.pdf")
-    c = canvas.Canvas(pdf_path, pagesize=letter)
-    width, height = letter
-    y_position = height - 50
 
-    # Se for apenas um arquivo (compatibilidade)
-    if not isinstance(files, list):
-        files = [files]
+def submit_job(tool, files, options=None):
+    """Salva os uploads no diretório do job e agenda a conversão no pool."""
+    purge_expired_jobs()
 
-    # Processar cada arquivo DOCX
-    for file_idx, file in enumerate(files):
-        docx_path = os.path.join(temp_dir, secure_filename(file.filename))
-        file.save(docx_path)
-
-        # Lê o documento Word
-        doc = Document(docx_path)
-
-        # Adicionar separador visual (exceto no primeiro documento)
-        if file_idx > 0:
-            # Quebra de página
-            c.showPage()
-            y_position = height - 50
-
-            # Adicionar cabeçalho com nome do arquivo
-            c.setFont("Helvetica-Bold", 12)
-            c.drawString(50, y_position, f"{'=' * 60}")
-            y_position -= 20
-            c.drawString(50, y_position, f"Documento: {file.filename}")
-            y_position -= 20
-            c.drawString(50, y_position, f"{'=' * 60}")
-            y_position -= 30
-            c.setFont("Helvetica", 11)
-
-        # Processar parágrafos
-        for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                # Quebra texto longo em múltiplas linhas
-                text = paragraph.text
-                max_width = width - 100
-
-                # Estimativa simples de largura de texto
-                approx_char_width = 6
-                chars_per_line = int(max_width / approx_char_width)
-
-                words = text.split()
-                lines = []
-                current_line = []
-
-                for word in words:
-                    if len(" ".join(current_line + [word])) <= chars_per_line:
-                        current_line.append(word)
-                    else:
-                        if current_line:
-                            lines.append(" ".join(current_line))
-                            current_line = [word]
-                        else:
-                            lines.append(word)
-
-                if current_line:
-                    lines.append(" ".join(current_line))
-
-                for line in lines:
-                    if y_position < 50:
-                        c.showPage()
-                        y_position = height - 50
-
-                    c.drawString(50, y_position, line)
-                    y_position -= 20
-
-        # Processar tabelas (se houver)
-        for table in doc.tables:
-            # Adicionar espaçamento antes da tabela
-            y_position -= 10
+    job_id = uuid.uuid4().hex
+    job_dir = _job_dir(job_id)
+    input_dir = os.path.join(job_dir, "input")
+    os.makedirs(input_dir)
 
-            if y_position < 100:
-                c.showPage()
-                y_position = height - 50
+    inputs = []
+    for idx, file in enumerate(files):
+        input_path = os.path.join(input_dir, f"{idx}_{secure_filename(file.filename)}")
+        source = upload_source(file, input_dir)
+        if isinstance(source, str):
+            _link_or_copy(source, input_path)
+        else:
+            with open(input_path, "wb") as f:
+                f.write(source)
+        inputs.append((input_path, file.filename))
 
-            # Desenhar linhas da tabela
-            c.setFont("Helvetica", 9)
-            for row in table.rows:
-                row_text = " | ".join([cell.text for cell in row.cells])
+    job = _write_job(
+        job_dir, id=job_id, tool=tool, status="queued", created_at=time.time()
+    )
 
-                # Quebrar texto da linha se necessário
-                if len(row_text) > 100:
-                    row_text = row_text[:97] + "..."
+    kind = job_kind(tool, files, options or {})
+    pool = _get_job_pool(kind)
+    try:
+        future = pool.submit(_run_job, job_dir, tool, inputs, options)
+    except BrokenProcessPool:
+        # Um worker morreu (ex.: OOM); recria o pool e tenta de novo
+        _discard_pool(f"job-{kind}", pool)
+        pool = _get_job_pool(kind)
+        future = pool.submit(_run_job, job_dir, tool, inputs, options)
+    INFLIGHT_JOBS.inc(kind)
+    future.add_done_callback(lambda f: _job_done(f, job_dir, kind, pool))
 
-                if y_position < 50:
-                    c.showPage()
-                    y_position = height - 50
+    job["status_url"] = f"/jobs/{job_id}"
+    return job
 
-                c.drawString(50, y_position, row_text)
-                y_position -= 15
 
-            # Espaçamento após tabela
-            y_position -= 10
-            c.setFont("Helvetica", 11)
+def job_kind(tool, files, options):
+    """
+    Pool do job: o das ferramentas pesadas para as marcadas com heavy=True e
+    para as leves com entradas grandes (custo estimado acima de JOB_HEAVY_COST),
+    para que não segurem os jobs rápidos atrás delas.
+    """
+    if TOOLS[tool]["heavy"]:
+        return "heavy"
+    try:
+        cost = estimate_cost(tool, files, options)
+    except ValueError:
+        return "light"
+    return "heavy" if cost >= app.config["JOB_HEAVY_COST"] else "light"
+
+
+def _run_job(job_dir, tool, inputs, options=None):
+    """Executado no processo do pool: converte e move o resultado para result/."""
+    _write_job(job_dir, status="running", started_at=time.time())
+    work_dir = os.path.join(job_dir, "work")
+    result_dir = os.path.join(job_dir, "result")
+    os.makedirs(work_dir, exist_ok=True)
+    os.makedirs(result_dir, exist_ok=True)
+
+    files = [
+        FileStorage(stream=open(path, "rb"), filename=filename)
+        for path, filename in inputs
+    ]
+    try:
+        pages = metrics.track_pages()
+        output_files = run_tool(tool, files, work_dir, options)
+        results = []
+        bytes_out = 0
+        for path in output_files:
+            name = os.path.basename(path)
+            bytes_out += os.path.getsize(path)
+            shutil.move(path, os.path.join(result_dir, name))
+            results.append(name)
+        _write_job(
+            job_dir,
+            status="finished",
+            results=results,
+            bytes_in=sum(os.path.getsize(path) for path, _ in inputs),
+            bytes_out=bytes_out,
+            pages=pages[0],
+            finished_at=time.time(),
+            expires_at=time.time() + app.config["JOB_RESULT_TTL"],
+        )
+    except Exception as e:
+        _write_job(
+            job_dir,
+            status="error",
+            error=str(e),
+            finished_at=time.time(),
+            expires_at=time.time() + app.config["JOB_RESULT_TTL"],
+        )
+    finally:
+        for file in files:
+            file.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        shutil.rmtree(os.path.join(job_dir, "input"), ignore_errors=True)
+
+
+def _job_done(future, job_dir, kind, pool):
+    """
+    Registra falhas que derrubaram o worker antes de ele gravar o status e
+    soma às métricas deste processo o que o worker gravou no job.json.
+    """
+    INFLIGHT_JOBS.dec(kind)
+    if future.cancelled():
+        _write_job(
+            job_dir,
+            status="error",
+            error="Servidor reiniciado antes de processar o job",
+            finished_at=time.time(),
+            expires_at=time.time() + app.config["JOB_RESULT_TTL"],
+        )
+        return
+    error = future.exception()
+    if error is None:
+        job = _read_job(os.path.basename(job_dir)) or {}
+        if job.get("status") == "finished":
+            BYTES_OUT.inc(job["tool"], amount=job["bytes_out"])
+            PAGES.inc(job["tool"], amount=job["pages"])
+        return
+    if isinstance(error, BrokenProcessPool):
+        _discard_pool(f"job-{kind}", pool)
+    _write_job(
+        job_dir,
+        status="error",
+        error=f"Falha no processo de conversão: {error}",
+        finished_at=time.time(),
+        expires_at=time.time() + app.config["JOB_RESULT_TTL"],
+    )
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    purge_expired_jobs()
+    job = _read_job(job_id) if JOB_ID_RE.match(job_id) else None
+    # A varredura é espaçada: um job expirado pode ainda estar no disco
+    if job is None or _job_expired(job, time.time()):
+        return jsonify({"error": "Job não encontrado ou expirado"}), 404
+    if job["status"] == "finished":
+        job["download_url"] = f"/jobs/{job_id}/download"
+    return jsonify(job)
+
+
+@app.route("/jobs/<job_id>/download", methods=["GET"])
+def job_download(job_id):
+    job = _read_job(job_id) if JOB_ID_RE.match(job_id) else None
+    if job is None or _job_expired(job, time.time()):
+        return jsonify({"error": "Job não encontrado ou expirado"}), 404
+    if job["status"] != "finished":
+        return jsonify(
+            {"error": "Job ainda não concluído", "status": job["status"]}
+        ), 409
+
+    result_dir = os.path.join(_job_dir(job_id), "result")
+    output_files = [os.path.join(result_dir, name) for name in job["results"]]
+    return build_response(output_files)
+
+
+UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class StoredUpload(FileStorage):
+    """Upload em partes já concluído, aberto direto do disco em /convert."""
+
+    def __init__(self, path, filename, sha256):
+        super().__init__(stream=open(path, "rb"), filename=filename)
+        # Conhecido desde a conclusão: o cache não relê o arquivo inteiro
+        self.sha256 = sha256
+
+
+def _upload_dir(upload_id):
+    return os.path.join(app.config["UPLOAD_FOLDER"], upload_id)
+
+
+def _read_upload(upload_id):
+    """Metadados do upload com o offset atual, ou None se não existir."""
+    if not UPLOAD_ID_RE.match(upload_id):
+        return None
+    upload_dir = _upload_dir(upload_id)
+    try:
+        with open(os.path.join(upload_dir, "upload.json"), encoding="utf-8") as f:
+            upload = json.load(f)
+        upload["offset"] = os.path.getsize(os.path.join(upload_dir, "data"))
+    except (OSError, ValueError):
+        return None
+    upload["upload_url"] = f"/uploads/{upload_id}"
+    return upload
+
+
+def _upload_response(upload, status=200):
+    response = jsonify(upload)
+    response.status_code = status
+    response.headers["Upload-Offset"] = str(upload["offset"])
+    return response
+
+
+def _lock_upload(f):
+    """Trava o arquivo do upload contra envios simultâneos (qualquer processo)."""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def purge_expired_uploads():
+    """Remove os uploads sem atividade há mais de UPLOAD_TTL segundos."""
+    limit = time.time() - app.config["UPLOAD_TTL"]
+    for upload_id in os.listdir(app.config["UPLOAD_FOLDER"]):
+        if not UPLOAD_ID_RE.match(upload_id):
+            continue
+        upload_dir = _upload_dir(upload_id)
+        try:
+            expired = os.path.getmtime(upload_dir) < limit
+        except OSError:
+            continue
+        if expired:
+            forget_preview(upload_id)
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+
+@app.route("/uploads", methods=["POST"])
+def create_upload():
+    """
+    Inicia um upload em partes, para arquivos grandes ou conexões instáveis.
+    Campos (JSON ou formulário): filename, size (opcional, em bytes) e sha256
+    (opcional; também pode ser informado só na conclusão).
+    """
+    purge_expired_uploads()
+    params = request.get_json(silent=True) or request.form
+
+    filename = params.get("filename") or ""
+    if not secure_filename(filename):
+        return jsonify({"error": "Informe o nome do arquivo (filename)"}), 400
+
+    size = params.get("size")
+    if size is not None:
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            return jsonify({"error": f"Valor inválido para size: {size}"}), 400
+        if size < 0:
+            return jsonify({"error": f"Valor inválido para size: {size}"}), 400
+        if size > app.config["UPLOAD_MAX_BYTES"]:
+            return jsonify({"error": "Arquivo maior que o limite de upload"}), 413
+
+    sha256 = (params.get("sha256") or "").lower() or None
+    if sha256 is not None and not SHA256_RE.match(sha256):
+        return jsonify({"error": "sha256 inválido"}), 400
+
+    upload_id = uuid.uuid4().hex
+    upload_dir = _upload_dir(upload_id)
+    os.makedirs(upload_dir)
+    open(os.path.join(upload_dir, "data"), "wb").close()
+    _update_json(
+        os.path.join(upload_dir, "upload.json"),
+        id=upload_id,
+        filename=filename,
+        size=size,
+        sha256=sha256,
+        complete=False,
+        created_at=time.time(),
+    )
+    return _upload_response(_read_upload(upload_id), 201)
+
+
+@app.route("/uploads/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    """Estado do upload; offset é de onde o próximo PUT deve continuar."""
+    upload = _read_upload(upload_id)
+    if upload is None:
+        return jsonify({"error": "Upload não encontrado ou expirado"}), 404
+    return _upload_response(upload)
+
+
+@app.route("/uploads/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    """
+    Acrescenta o corpo da requisição ao upload. O cabeçalho Upload-Offset
+    precisa ser igual ao offset atual; cada parte pode ter até
+    MAX_CONTENT_LENGTH bytes e é gravada em disco enquanto chega. Se a conexão
+    cair, o que chegou fica salvo e o envio continua a partir do novo offset.
+    """
+    upload = _read_upload(upload_id)
+    if upload is None:
+        return jsonify({"error": "Upload não encontrado ou expirado"}), 404
+    if upload["complete"]:
+        return jsonify({"error": "Upload já concluído"}), 409
+
+    try:
+        offset = int(request.headers["Upload-Offset"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "Informe o cabeçalho Upload-Offset"}), 400
+
+    upload_dir = _upload_dir(upload_id)
+    limit = upload["size"]
+    if limit is None:
+        limit = app.config["UPLOAD_MAX_BYTES"]
+
+    with open(os.path.join(upload_dir, "data"), "r+b") as f:
+        if not _lock_upload(f):
+            return jsonify({"error": "Outra parte deste upload está em envio"}), 409
+        # Relido sob o lock: a conclusão grava complete=True com o arquivo travado
+        upload = _read_upload(upload_id)
+        if upload is None:
+            return jsonify({"error": "Upload não encontrado ou expirado"}), 404
+        if upload["complete"]:
+            return jsonify({"error": "Upload já concluído"}), 409
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            return _upload_response(
+                dict(upload, offset=current, error="Upload-Offset diferente do atual"),
+                409,
+            )
+        f.seek(current)
+        try:
+            while chunk := request.stream.read(STREAM_CHUNK_SIZE):
+                if f.tell() + len(chunk) > limit:
+                    f.truncate(current)
+                    return jsonify(
+                        {"error": "Arquivo maior que o tamanho do upload"}
+                    ), 413
+                f.write(chunk)
+        except ClientDisconnected:
+            # Mantém o que já foi gravado; o cliente retoma pelo offset
+            pass
+        f.flush()
+        offset = f.tell()
+    # mtime do diretório marca a última atividade (expiração)
+    os.utime(upload_dir)
+    return _upload_response(dict(upload, offset=offset))
+
+
+@app.route("/uploads/<upload_id>/complete", methods=["POST"])
+def complete_upload(upload_id):
+    """
+    Conclui o upload conferindo o sha256 do conteúdo recebido (informado
+    agora ou na criação). Depois disso, o id pode ser usado em /convert no
+    campo upload_ids, por qualquer ferramenta e quantas vezes for preciso.
+    """
+    if _read_upload(upload_id) is None:
+        return jsonify({"error": "Upload não encontrado ou expirado"}), 404
+
+    upload_dir = _upload_dir(upload_id)
+    with open(os.path.join(upload_dir, "data"), "rb") as f:
+        if not _lock_upload(f):
+            return jsonify({"error": "Outra parte deste upload está em envio"}), 409
+        # Relido sob o lock, que só é liberado depois de gravar complete=True:
+        # nenhum PUT muda o conteúdo entre a conferência e a conclusão
+        upload = _read_upload(upload_id)
+        if upload is None:
+            return jsonify({"error": "Upload não encontrado ou expirado"}), 404
+        if upload["complete"]:
+            return _upload_response(upload)
+
+        params = request.get_json(silent=True) or request.form
+        expected = (params.get("sha256") or upload["sha256"] or "").lower()
+        if not SHA256_RE.match(expected):
+            return jsonify({"error": "Informe o sha256 do arquivo"}), 400
+        if upload["size"] is not None and upload["offset"] != upload["size"]:
+            return _upload_response(
+                dict(upload, error="Upload incompleto: faltam partes"), 409
+            )
+
+        digest = hashlib.sha256()
+        while chunk := f.read(STREAM_CHUNK_SIZE):
+            digest.update(chunk)
+        if digest.hexdigest() != expected:
+            return _upload_response(
+                dict(
+                    upload,
+                    error="sha256 não confere com o conteúdo recebido",
+                    received_sha256=digest.hexdigest(),
+                ),
+                409,
+            )
+
+        _update_json(
+            os.path.join(upload_dir, "upload.json"),
+            sha256=expected,
+            size=upload["offset"],
+            complete=True,
+            completed_at=time.time(),
+        )
+    os.utime(upload_dir)
+    return _upload_response(_read_upload(upload_id))
+
+
+@app.route("/uploads/<upload_id>", methods=["DELETE"])
+def delete_upload(upload_id):
+    if _read_upload(upload_id) is None:
+        return jsonify({"error": "Upload não encontrado ou expirado"}), 404
+    forget_preview(upload_id)
+    shutil.rmtree(_upload_dir(upload_id), ignore_errors=True)
+    return "", 204
+
+
+def open_uploads(upload_ids):
+    """
+    StoredUpload de cada upload concluído em upload_ids (separados por
+    vírgula). LookupError para ids desconhecidos e ValueError para uploads
+    ainda em andamento.
+    """
+    files = []
+    try:
+        for upload_id in (upload_ids or "").split(","):
+            upload_id = upload_id.strip()
+            if not upload_id:
+                continue
+            upload = _read_upload(upload_id)
+            if upload is None:
+                raise LookupError(f"Upload não encontrado ou expirado: {upload_id}")
+            if not upload["complete"]:
+                raise ValueError(f"Upload ainda não concluído: {upload_id}")
+            upload_dir = _upload_dir(upload_id)
+            files.append(
+                StoredUpload(
+                    os.path.join(upload_dir, "data"),
+                    upload["filename"],
+                    upload["sha256"],
+                )
+            )
+            os.utime(upload_dir)
+    except Exception:
+        for file in files:
+            file.close()
+        raise
+    return files
+
+
+PREVIEW_MIMETYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# _preview_lock protege só os dois LRUs. Cada documento tem o próprio lock:
+# o PyMuPDF não pode usar o mesmo documento em duas threads ao mesmo tempo,
+# mas documentos diferentes renderizam em paralelo. O LRU de documentos é
+# limitado em número; um documento aberto ocupa pouco além da tabela de xref,
+# e fontes e imagens decodificadas ficam no store global do MuPDF
+# (fitz.TOOLS.store_maxsize, 256 MB por padrão), que é o limite real de memória
+_preview_lock = threading.Lock()
+_preview_documents = collections.OrderedDict()  # upload_id -> (doc, lock)
+_preview_tiles = collections.OrderedDict()  # (upload_id, página, ...) -> bytes
+_preview_tiles_bytes = 0
+
+PREVIEW_CACHE = metrics.Counter(
+    "localpdf_preview_cache_total",
+    "Buscas nos caches da pré-visualização de páginas",
+    ("cache", "result"),
+)
+
+
+def _preview_upload(upload_id):
+    """Caminho e metadados de um upload de PDF concluído, ou uma resposta de erro."""
+    upload = _read_upload(upload_id)
+    if upload is None:
+        return None, (jsonify({"error": "Upload não encontrado ou expirado"}), 404)
+    if not upload["complete"]:
+        return None, (jsonify({"error": "Upload ainda não concluído"}), 409)
+    if not allowed_file(upload["filename"], {"pdf"}):
+        return None, (jsonify({"error": "Pré-visualização só para PDFs"}), 400)
+    return upload, None
+
+
+def _preview_document(upload_id):
+    """
+    (documento, lock) do LRU, abrindo o upload se preciso. Quem usa o
+    documento segura o lock dele e confere se ele não foi fechado ao sair do LRU.
+    """
+    with _preview_lock:
+        entry = _preview_documents.pop(upload_id, None)
+        if entry is not None:
+            PREVIEW_CACHE.inc("document", "hit")
+            _preview_documents[upload_id] = entry
+            return entry
+    PREVIEW_CACHE.inc("document", "miss")
+    # Abrir só lê o trailer e a xref; fica fora do lock global
+    doc = open_pdf(os.path.join(_upload_dir(upload_id), "data"))
+    evicted = []
+    with _preview_lock:
+        entry = _preview_documents.pop(upload_id, None)
+        if entry is None:
+            entry = (doc, threading.Lock())
+            doc = None
+        while len(_preview_documents) >= app.config["PREVIEW_MAX_DOCUMENTS"]:
+            evicted.append(_preview_documents.popitem(last=False)[1])
+        _preview_documents[upload_id] = entry
+    if doc is not None:
+        # Outra thread abriu o mesmo upload antes
+        doc.close()
+    _close_preview_documents(evicted)
+    return entry
+
+
+def _close_preview_documents(entries):
+    # Espera a renderização em andamento de cada documento antes de fechá-lo
+    for doc, lock in entries:
+        with lock:
+            doc.close()
+
+
+def _with_preview_document(upload_id, func):
+    """Chama func(doc) com o lock do documento do upload."""
+    while True:
+        doc, lock = _preview_document(upload_id)
+        with lock:
+            # Fechado por ter saído do LRU entre a busca e o lock: reabre
+            if not doc.is_closed:
+                return func(doc)
+
+
+def render_preview(upload_id, page_num, width, image_format, quality):
+    """
+    Imagem da página (base 0) com a largura pedida, em bytes. Só a página
+    pedida é renderizada; o resultado fica no LRU de PREVIEW_CACHE_BYTES.
+    """
+    global _preview_tiles_bytes
+    key = (upload_id, page_num, width, image_format, quality)
+    with _preview_lock:
+        data = _preview_tiles.get(key)
+        if data is not None:
+            PREVIEW_CACHE.inc("tile", "hit")
+            _preview_tiles.move_to_end(key)
+            return data
+    PREVIEW_CACHE.inc("tile", "miss")
+
+    def render(doc):
+        if not 0 <= page_num < len(doc):
+            raise LookupError(f"Página inexistente: {page_num + 1}")
+        return _render_tile(doc.load_page(page_num), width, image_format, quality)
+
+    data = _with_preview_document(upload_id, render)
+
+    limit = app.config["PREVIEW_CACHE_BYTES"]
+    if len(data) <= limit:
+        with _preview_lock:
+            if key not in _preview_tiles:
+                _preview_tiles[key] = data
+                _preview_tiles_bytes += len(data)
+            while _preview_tiles_bytes > limit:
+                _, oldest = _preview_tiles.popitem(last=False)
+                _preview_tiles_bytes -= len(oldest)
+    return data
+
+
+def _render_tile(page, width, image_format, quality):
+    import fitz  # PyMuPDF
+
+    # Páginas muito compridas não passam do orçamento de pixels
+    zoom = fit_pixel_budget(
+        page.rect.width,
+        page.rect.height,
+        width / page.rect.width,
+        app.config["RENDER_MAX_PIXELS"],
+    )
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    if image_format == "png":
+        return pix.tobytes("png")
+    if image_format == "jpeg":
+        return pix.tobytes("jpeg", jpg_quality=quality)
+
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    img.save(buffer, "WEBP", quality=quality)
+    return buffer.getvalue()
+
+
+def forget_preview(upload_id):
+    """Tira dos caches o documento e as imagens de um upload removido."""
+    global _preview_tiles_bytes
+    with _preview_lock:
+        entry = _preview_documents.pop(upload_id, None)
+        for key in [key for key in _preview_tiles if key[0] == upload_id]:
+            _preview_tiles_bytes -= len(_preview_tiles.pop(key))
+    if entry is not None:
+        _close_preview_documents([entry])
+
+
+@app.route("/uploads/<upload_id>/pages", methods=["GET"])
+def preview_pages(upload_id):
+    """Número de páginas e tamanho (pontos) de cada uma, para montar a rolagem."""
+    upload, error = _preview_upload(upload_id)
+    if error:
+        return error
+    sizes = _with_preview_document(
+        upload_id, lambda doc: [[page.rect.width, page.rect.height] for page in doc]
+    )
+    return jsonify({"page_count": len(sizes), "sizes": sizes})
+
+
+@app.route("/uploads/<upload_id>/pages/<int:page>", methods=["GET"])
+def preview_page(upload_id, page):
+    """
+    Página (base 1) de um upload de PDF como imagem, para miniaturas e
+    pré-visualização. Parâmetros: width em pixels (padrão 300), format (png,
+    jpeg, webp) e quality (jpeg/webp).
+    """
+    upload, error = _preview_upload(upload_id)
+    if error:
+        return error
+    try:
+        width = int_option(
+            request.args, "width", 300, 16, app.config["PREVIEW_MAX_WIDTH"]
+        )
+        image_format = IMAGE_FORMATS.get((request.args.get("format") or "png").lower())
+        if image_format is None:
+            raise ValueError(
+                f"Formato de imagem não suportado: {request.args.get('format')}"
+            )
+        quality = int_option(request.args, "quality", 80, 1, 100)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        data = render_preview(upload_id, page - 1, width, image_format, quality)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+
+    response = Response(data, mimetype=PREVIEW_MIMETYPES[image_format])
+    # O conteúdo de um upload concluído nunca muda
+    response.set_etag(
+        f"{upload['sha256'][:16]}-{page}-{width}-{image_format}-{quality}"
+    )
+    response.cache_control.private = True
+    response.cache_control.max_age = app.config["UPLOAD_TTL"]
+    return response.make_conditional(request)
+
+
+BATCH_REPORT_NAME = "batch_report.json"
+
+
+def run_batch(tool, files, temp_dir, options, stages):
+    """
+    Modo batch (batch=1): aplica a ferramenta a cada arquivo de forma
+    independente, em paralelo no pool de BATCH_WORKERS processos. Devolve um
+    gerador de (caminho, nome no zip) na ordem em que os arquivos terminam;
+    cada resultado fica numa pasta com o nome do arquivo de origem e o
+    batch_report.json final lista o resultado (ou o erro) de cada arquivo.
+    """
+    input_dir = os.path.join(temp_dir, "input")
+    os.makedirs(input_dir)
+    tasks = []
+    folders = set()
+    for idx, file in enumerate(files):
+        source = upload_source(file, input_dir)
+        if isinstance(source, str):
+            # O arquivo temporário do upload é apagado ao fim da requisição,
+            # antes de o lote terminar de ser enviado
+            input_path = os.path.join(
+                input_dir, f"{idx}_{secure_filename(file.filename)}"
+            )
+            _link_or_copy(source, input_path)
+            source = input_path
+
+        folder = os.path.splitext(secure_filename(file.filename))[0] or "arquivo"
+        base, suffix = folder, 2
+        while folder in folders:
+            folder = f"{base}_{suffix}"
+            suffix += 1
+        folders.add(folder)
+
+        work_dir = os.path.join(temp_dir, str(idx))
+        tasks.append(((tool, source, file.filename, work_dir, options), folder))
+    return _iter_batch(tool, tasks, temp_dir, stages)
+
+
+def _iter_batch(tool, tasks, temp_dir, stages):
+    entries = []
+    results = _batch_results(tasks)
+    try:
+        while True:
+            # Só a espera pelas conversões conta como etapa convert
+            waiting = time.perf_counter()
+            item = next(results, None)
+            stages["convert"] += time.perf_counter() - waiting
+            if item is None:
+                break
+            folder, filename, outcome, error = item
+            if error is not None:
+                entries.append(
+                    {"file": filename, "status": "error", "error": str(error)}
+                )
+                continue
+
+            output_files, pages = outcome
+            names = []
+            for path in output_files:
+                name = f"{folder}/{os.path.basename(path)}"
+                names.append(name)
+                BYTES_OUT.inc(tool, amount=os.path.getsize(path))
+                yield path, name
+                # Já está no zip: libera o disco durante lotes grandes
+                os.remove(path)
+            PAGES.inc(tool, amount=pages)
+            entries.append({"file": filename, "status": "ok", "outputs": names})
+    finally:
+        # Cliente desconectado: cancela os arquivos que ainda estão na fila
+        results.close()
+
+    failed = sum(1 for entry in entries if entry["status"] == "error")
+    report_path = os.path.join(temp_dir, BATCH_REPORT_NAME)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "tool": tool,
+                "total": len(entries),
+                "succeeded": len(entries) - failed,
+                "failed": failed,
+                "files": entries,
+            },
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    yield report_path, BATCH_REPORT_NAME
+
+
+def _batch_results(tasks):
+    """(pasta, nome, resultado, erro) de cada tarefa, na ordem de conclusão."""
+    workers = min(app.config["BATCH_WORKERS"], len(tasks))
+    if workers <= 1:
+        for task, folder in tasks:
+            try:
+                yield folder, task[2], _run_batch_item(task), None
+            except Exception as e:
+                yield folder, task[2], None, e
+        return
+
+    pool = _get_pool(
+        "batch",
+        ProcessPoolExecutor,
+        max_workers=app.config["BATCH_WORKERS"],
+        initializer=_single_worker_init,
+    )
+    futures = {
+        pool.submit(_run_batch_item, task): (folder, task[2]) for task, folder in tasks
+    }
+    try:
+        for future in as_completed(futures):
+            folder, filename = futures[future]
+            try:
+                yield folder, filename, future.result(), None
+            except BrokenProcessPool as e:
+                # Um worker morreu (ex.: OOM); o próximo lote recria o pool
+                _discard_pool("batch", pool)
+                yield folder, filename, None, f"Falha no processo de conversão: {e}"
+            except Exception as e:
+                yield folder, filename, None, e
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _run_batch_item(task):
+    tool, source, filename, work_dir, options = task
+    os.makedirs(work_dir)
+    stream = io.BytesIO(source) if isinstance(source, bytes) else open(source, "rb")
+    file = FileStorage(stream=stream, filename=filename)
+    try:
+        pages = metrics.track_pages()
+        output_files = run_tool(tool, [file], work_dir, options)
+    finally:
+        file.close()
+    return output_files, pages[0]
+
+
+IMAGE_FORMATS = {"png": "png", "jpg": "jpeg", "jpeg": "jpeg", "webp": "webp"}
+
+
+def render_cost(stats, options):
+    """Páginas A4 em RGB no DPI pedido, uma por processo de renderização."""
+    try:
+        dpi = int_option(options, "dpi", 144, 36, 600)
+    except ValueError:
+        dpi = 144
+    page_pixels = min(8.27 * 11.69 * dpi * dpi, app.config["RENDER_MAX_PIXELS"])
+    page_mb = page_pixels * 3 / (1024 * 1024)
+    pages = min(stats["pages"], app.config["PARALLEL_WORKERS"])
+    return 16 + 2 * stats["mb"] + page_mb * pages
+
+
+@tool(
+    "pdf-to-images",
+    extensions={"pdf"},
+    modules=("fitz", "PIL.Image"),
+    heavy=True,
+    cost=render_cost,
+)
+def pdf_to_images(file, temp_dir, options=None):
+    """
+    Renderiza as páginas do PDF como imagens, dividindo as páginas entre
+    processos. Opções: dpi (padrão 144), format (png, jpeg, webp),
+    quality (jpeg/webp) e pages (ex.: "1-3,7").
+
+    Páginas acima de RENDER_MAX_PIXELS no DPI pedido (plantas em A0, páginas
+    muito largas) não são renderizadas inteiras em memória. A opção oversize
+    escolhe o que fazer: scale reduz o DPI da página até caber; tiles (só PNG)
+    mantém o DPI e grava a imagem em faixas. O padrão, auto, usa tiles para
+    PNG e scale para os demais formatos.
+    """
+    options = options or {}
+    source = upload_source(file, temp_dir)
+
+    doc = open_pdf(source)
+    pages = parse_page_ranges(options.get("pages"), len(doc))
+    doc.close()
+    metrics.add_pages(len(pages))
+
+    return render_images(source, pages, temp_dir, options)
+
+
+def render_images(source, pages, output_dir, options, prefix="page"):
+    """
+    Renderiza as páginas (base 0) do PDF em source (bytes ou caminho) como
+    <prefix>_<n>.<ext> em output_dir, com as opções dpi, format e quality.
+    """
+    dpi = int_option(options, "dpi", 144, 36, 600)
+    image_format = IMAGE_FORMATS.get((options.get("format") or "png").lower())
+    if image_format is None:
+        raise ValueError(f"Formato de imagem não suportado: {options.get('format')}")
+    quality = int_option(options, "quality", 85, 1, 100)
+    oversize = (options.get("oversize") or "auto").lower()
+    if oversize not in ("auto", "scale", "tiles"):
+        raise ValueError(f"Valor inválido para oversize: {oversize}")
+    if oversize == "tiles" and image_format != "png":
+        raise ValueError("oversize=tiles só é suportado com format=png")
+    tiles = image_format == "png" and oversize != "scale"
+    limits = (
+        app.config["RENDER_MAX_PIXELS"],
+        app.config["RENDER_MAX_TILED_PIXELS"] if tiles else 0,
+    )
+
+    # Cada processo abre o próprio documento e renderiza um bloco contíguo
+    tasks = [
+        (source, chunk, output_dir, prefix, dpi, image_format, quality, limits)
+        for chunk in chunk_list(pages, app.config["PARALLEL_WORKERS"])
+        if chunk
+    ]
+    output_files = []
+    for chunk_files in parallel_map(_render_pages, tasks):
+        output_files.extend(chunk_files)
+    return output_files
+
+
+def _render_pages(task):
+    import fitz  # PyMuPDF
+    from PIL import Image
+
+    source, pages, output_dir, prefix, dpi, image_format, quality, limits = task
+    max_pixels, max_tiled_pixels = limits
+    extension = "jpg" if image_format == "jpeg" else image_format
+    output_files = []
+
+    doc = open_pdf(source)
+    try:
+        for page_num in pages:
+            page = doc.load_page(page_num)
+            img_path = os.path.join(output_dir, f"{prefix}_{page_num + 1}.{extension}")
+            width, height = page.rect.width, page.rect.height
+            zoom = dpi / 72
+            if max_tiled_pixels and width * zoom * height * zoom > max_pixels:
+                zoom = fit_pixel_budget(width, height, zoom, max_tiled_pixels)
+                _render_png_bands(page, zoom, img_path, max_pixels)
+                output_files.append(img_path)
+                continue
+
+            zoom = fit_pixel_budget(width, height, zoom, max_pixels)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            if image_format == "png":
+                pix.save(img_path)
+            elif image_format == "jpeg":
+                pix.save(img_path, output="jpg", jpg_quality=quality)
+            else:
+                img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+                img.save(img_path, "WEBP", quality=quality)
+            output_files.append(img_path)
+    finally:
+        doc.close()
+    return output_files
+
+
+def fit_pixel_budget(width, height, zoom, max_pixels):
+    """Zoom reduzido para que a página (em pontos) caiba em max_pixels."""
+    pixels = width * zoom * height * zoom
+    if pixels <= max_pixels:
+        return zoom
+    return zoom * math.sqrt(max_pixels / pixels)
+
+
+class _PngWriter:
+    """Codificador PNG (RGB, 8 bits) que recebe as linhas aos poucos."""
+
+    IDAT_SIZE = 256 * 1024
+
+    def __init__(self, f, width, height):
+        self._f = f
+        self._compressor = zlib.compressobj(6)
+        self._pending = []
+        self._pending_size = 0
+        f.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self._f.write(struct.pack(">I", len(data)))
+        self._f.write(kind)
+        self._f.write(data)
+        self._f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    def _push(self, data):
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+        if self._pending_size >= self.IDAT_SIZE:
+            self._chunk(b"IDAT", b"".join(self._pending))
+            self._pending.clear()
+            self._pending_size = 0
+
+    def write_row(self, row):
+        # Filtro 0 (nenhum) em cada linha
+        self._push(self._compressor.compress(b"\x00"))
+        self._push(self._compressor.compress(row))
+
+    def close(self):
+        self._pending.append(self._compressor.flush())
+        self._chunk(b"IDAT", b"".join(self._pending))
+        self._pending.clear()
+        self._chunk(b"IEND", b"")
+
+
+# Linhas extras de cada lado das faixas de _render_png_bands
+BAND_OVERLAP = 2
+
+
+def _render_png_bands(page, zoom, img_path, max_pixels):
+    """
+    Grava a página como PNG em faixas horizontais de até max_pixels: só uma
+    faixa fica em memória, qualquer que seja o tamanho final da imagem.
+    """
+    import fitz  # PyMuPDF
+
+    matrix = fitz.Matrix(zoom, zoom)
+    bbox = (page.rect * matrix).irect
+    width = bbox.width
+    rows_per_band = max(1, max_pixels // width)
+    blank_row = b"\xff" * (width * 3)
+    # A lista de exibição interpreta o conteúdo da página uma vez só
+    display_list = page.get_displaylist()
+
+    with open(img_path, "wb") as f:
+        writer = _PngWriter(f, width, bbox.height)
+        for top in range(bbox.y0, bbox.y1, rows_per_band):
+            bottom = min(top + rows_per_band, bbox.y1)
+            # Faixa renderizada com BAND_OVERLAP pixels a mais em cima e embaixo:
+            # o anti-aliasing é cortado na borda do clip, e as linhas de sobra
+            # são descartadas abaixo. Texto e preenchimentos saem idênticos à
+            # página inteira; traços que cruzam a borda ainda variam alguns
+            # níveis, porque o MuPDF recalcula a aresta cortada pelo clip
+            clip = (
+                fitz.Rect(bbox.x0, top - BAND_OVERLAP, bbox.x1, bottom + BAND_OVERLAP)
+                * ~matrix
+            )
+            pix = display_list.get_pixmap(matrix=matrix, clip=clip, alpha=False)
+            samples = pix.samples_mv
+            offset = (bbox.x0 - pix.x) * pix.n
+            for y in range(top, bottom):
+                row = y - pix.y
+                if 0 <= row < pix.height and offset >= 0 and pix.width >= width:
+                    start = row * pix.stride + offset
+                    writer.write_row(samples[start : start + width * 3])
+                else:
+                    writer.write_row(blank_row)
+            del samples, pix
+        writer.close()
+
+
+# Orientação EXIF -> rotação (anti-horária) aplicada ao inserir o JPEG original
+EXIF_ROTATIONS = {1: 0, 3: 180, 6: 270, 8: 90}
+PAGE_SIZES = {"a4": (595, 842), "letter": (612, 792)}  # pontos
+
+
+@tool(
+    "images-to-pdf",
+    extensions={"jpg", "jpeg", "png"},
+    modules=("fitz", "PIL.Image"),
+    multiple=True,
+    # Imagens que não são JPEG são decodificadas (cerca de 10x o arquivo)
+    cost=linear_cost(16, per_mb=12),
+)
+def images_to_pdf(files, temp_dir, options=None):
+    """
+    Monta o PDF acrescentando uma página por imagem, sem manter o lote inteiro
+    decodificado em memória. JPEGs entram no PDF como estão (sem recompressão),
+    a orientação EXIF é respeitada e as demais imagens são codificadas uma vez.
+    Opções: page_size (auto, a4, letter) e dpi (reduz imagens acima desse DPI
+    na página).
+    """
+    import fitz  # PyMuPDF
+
+    options = options or {}
+    page_size = (options.get("page_size") or "auto").lower()
+    if page_size != "auto" and page_size not in PAGE_SIZES:
+        raise ValueError(f"Tamanho de página não suportado: {page_size}")
+    max_dpi = int_option(options, "dpi", None, 1)
+
+    doc = fitz.open()
+    for file in files:
+        source = upload_source(file, temp_dir)
+        _append_image_page(doc, source, page_size, max_dpi)
+    metrics.add_pages(len(files))
+
+    pdf_path = os.path.join(temp_dir, "images_to_pdf.pdf")
+    doc.save(pdf_path)
+    doc.close()
 
-    c.save()
     return [pdf_path]
 
 
-def pdf_to_word(file, temp_dir):
+def _append_image_page(doc, source, page_size, max_dpi):
+    # Image.open só lê o cabeçalho; os pixels são carregados apenas se necessário
+    import fitz  # PyMuPDF
+    from PIL import Image, ImageOps
+
+    img = Image.open(as_file(source))
+    orientation = img.getexif().get(0x0112, 1)
+    width, height = img.size
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+
+    # "auto" mantém o tamanho anterior: 1 pixel = 1 ponto (72 DPI)
+    if page_size == "auto":
+        page = doc.new_page(width=width, height=height)
+        rect = page.rect
+    else:
+        page_width, page_height = PAGE_SIZES[page_size]
+        page = doc.new_page(width=page_width, height=page_height)
+        scale = min(page_width / width, page_height / height)
+        left = (page_width - width * scale) / 2
+        top = (page_height - height * scale) / 2
+        rect = fitz.Rect(left, top, left + width * scale, top + height * scale)
+
+    dpi = width / (rect.width / 72)
+    downscale = max_dpi is not None and dpi > max_dpi
+    is_jpeg = img.format == "JPEG"
+
+    if (
+        is_jpeg
+        and img.mode in ("RGB", "L")
+        and orientation in EXIF_ROTATIONS
+        and not downscale
+    ):
+        stream = source if isinstance(source, bytes) else None
+        filename = source if isinstance(source, str) else None
+        page.insert_image(
+            rect,
+            stream=stream,
+            filename=filename,
+            rotate=EXIF_ROTATIONS[orientation],
+            keep_proportion=False,
+        )
+        img.close()
+        return
+
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    if downscale:
+        scale = max_dpi / dpi
+        size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+        img = img.resize(size, Image.LANCZOS)
+
+    # Fotos continuam JPEG; o restante vai como pixmap e o PyMuPDF comprime uma vez
+    if is_jpeg:
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=90)
+        img.close()
+        page.insert_image(rect, stream=buffer.getvalue(), keep_proportion=False)
+        return
+
+    colorspace = fitz.csGRAY if img.mode == "L" else fitz.csRGB
+    pixmap = fitz.Pixmap(colorspace, img.width, img.height, img.tobytes(), False)
+    img.close()
+    page.insert_image(rect, pixmap=pixmap, keep_proportion=False)
+
+
+@tool(
+    "merge-pdf",
+    extensions={"pdf"},
+    modules=("fitz",),
+    multiple=True,
+    cost=linear_cost(8, per_mb=2),
+)
+def merge_pdfs(files, temp_dir, options=None):
+    """
+    Mescla os PDFs na ordem enviada. Opções:
+    - page_ranges: páginas de cada arquivo, separadas por ";" na mesma ordem,
+      ex.: "1-3;;5-" (vazio = todas as páginas daquele arquivo)
+    - bookmarks: none (padrão), files (um marcador por arquivo) ou keep (um
+      por arquivo, com os marcadores originais dentro dele)
+    Cada arquivo é aberto só na sua vez; fontes, imagens e streams repetidos
+    entre os arquivos são gravados uma única vez.
+    """
+    options = options or {}
+    specs = merge_page_specs(options.get("page_ranges"), len(files))
+    documents = (
+        (file.filename, open_pdf(upload_source(file, temp_dir))) for file in files
+    )
+    merged_doc = merge_documents(documents, specs, options)
+
+    metrics.add_pages(len(merged_doc))
+    output_path = os.path.join(temp_dir, "merged.pdf")
+    merged_doc.save(output_path, **pdf_save_options())
+    merged_doc.close()
+
+    return [output_path]
+
+
+MERGE_BOOKMARKS = ("none", "files", "keep")
+
+# Objetos sem stream que podem ser compartilhados entre as entradas, além das
+# arrays (larguras de fontes, espaços de cor) e dos /Resources das páginas
+MERGE_SHARED_TYPES = {"/Font", "/FontDescriptor", "/Encoding", "/ExtGState"}
+
+OBJECT_REF_RE = re.compile(r"\b(\d+) 0 R\b")
+
+
+def merge_page_specs(spec, count):
+    """Intervalos de páginas de cada entrada; None onde o arquivo vai inteiro."""
+    if not spec or not spec.strip():
+        return [None] * count
+    specs = [item.strip() or None for item in spec.split(";")]
+    if len(specs) != count:
+        raise ValueError(
+            f"page_ranges tem {len(specs)} intervalos para {count} arquivos "
+            '(separe com ";", vazio para o arquivo inteiro)'
+        )
+    return specs
+
+
+def merge_documents(documents, specs, options):
+    """
+    Insere os documentos (pares nome, doc) num PDF novo, fechando cada um logo
+    após a inserção. Os objetos repetidos de cada entrada são trocados pela
+    cópia já inserida, então a memória cresce com o conteúdo distinto e não
+    com o número de arquivos.
+    """
+    import fitz  # PyMuPDF
+
+    bookmarks = (options.get("bookmarks") or "none").lower()
+    if bookmarks not in MERGE_BOOKMARKS:
+        raise ValueError(f"Modo de marcadores não suportado: {bookmarks}")
+
+    merged_doc = fitz.open()
+    seen = {}
+    toc = []
+    for (name, doc), spec in zip(documents, specs):
+        first_xref = merged_doc.xref_length()
+        start_page = len(merged_doc)
+        try:
+            try:
+                pages = parse_page_ranges(spec, len(doc))
+            except ValueError as exc:
+                raise ValueError(f"{name}: {exc}") from None
+            for start, end in _page_runs(pages):
+                merged_doc.insert_pdf(doc, from_page=start, to_page=end)
+            if pages and bookmarks != "none":
+                toc.append([1, os.path.splitext(name)[0], start_page + 1])
+                if bookmarks == "keep":
+                    toc.extend(_shifted_toc(doc.get_toc(), pages, start_page))
+        finally:
+            doc.close()
+        _share_objects(merged_doc, first_xref, seen)
+        # Sem isso, o cache de recursos do MuPDF guarda fontes e imagens de
+        # todos os arquivos já inseridos
+        fitz.TOOLS.store_shrink(100)
+
+    if not len(merged_doc):
+        merged_doc.close()
+        raise ValueError("Nenhuma página selecionada para mesclar")
+    if toc:
+        merged_doc.set_toc(toc)
+    return merged_doc
+
+
+def _page_runs(pages):
+    """Agrupa índices consecutivos em trechos (início, fim) para o insert_pdf."""
+    runs = []
+    for page_num in pages:
+        if runs and page_num == runs[-1][1] + 1:
+            runs[-1][1] = page_num
+        else:
+            runs.append([page_num, page_num])
+    return runs
+
+
+def _shifted_toc(entries, pages, start_page):
+    """
+    Marcadores originais um nível abaixo do marcador do arquivo, apontando para
+    as novas posições; os de páginas que ficaram de fora são descartados.
+    """
+    positions = {}
+    for index, page_num in enumerate(pages):
+        positions.setdefault(page_num, start_page + index + 1)
+    shifted = []
+    level = 1
+    for entry_level, title, page in entries:
+        if page - 1 not in positions:
+            continue
+        # Sem o pai, o filho sobe de nível para manter a hierarquia válida
+        level = min(entry_level + 1, level + 1)
+        shifted.append([level, title, positions[page - 1]])
+    return shifted
+
+
+def _share_objects(doc, first_xref, seen):
+    """
+    Troca os objetos inseridos a partir de first_xref que repetem um objeto já
+    existente (mesmo hash do dicionário e do stream bruto) pela primeira cópia,
+    e esvazia as duplicatas. seen (hash -> xref) acompanha todas as entradas.
+    Páginas, anotações e demais objetos com identidade própria não entram.
+    """
+    sources = {}
+    candidates = {}
+    stream_digests = {}
+    for xref in range(first_xref, doc.xref_length()):
+        source = sources[xref] = doc.xref_object(xref, compressed=True)
+        if doc.xref_is_stream(xref):
+            stream_digests[xref] = hashlib.sha256(doc.xref_stream_raw(xref)).digest()
+            candidates[xref] = None
+            continue
+        kind = doc.xref_get_key(xref, "Type")[1]
+        if source.startswith("[") or kind in MERGE_SHARED_TYPES:
+            candidates[xref] = None
+        elif kind == "/Page":
+            kind, value = doc.xref_get_key(xref, "Resources")
+            if kind == "xref":
+                candidates[int(value.split()[0])] = None
+
+    remap = {}
+    added = set()
+
+    def resolve(xref):
+        # Uma cópia pode ter virado duplicata de outra numa passada seguinte
+        while xref in remap:
+            xref = remap[xref]
+        return xref
+
+    def remapped(source):
+        if not remap or " R" not in source:
+            return source
+        return OBJECT_REF_RE.sub(lambda match: f"{resolve(int(match[1]))} 0 R", source)
+
+    # Um objeto só repete outro depois que as referências dele foram trocadas
+    # (a fonte aponta para o descritor, que aponta para o arquivo da fonte)
+    changed = True
+    while changed:
+        changed = False
+        for xref in candidates:
+            if xref in remap or xref not in sources:
+                continue
+            digest = hashlib.sha256(
+                remapped(sources[xref]).encode("utf-8", "surrogatepass")
+            )
+            if xref in stream_digests:
+                digest.update(stream_digests[xref])
+            key = digest.digest()
+            original = resolve(seen.setdefault(key, xref))
+            if original == xref:
+                added.add(key)
+            else:
+                remap[xref] = original
+                changed = True
+
+    # Hashes que apontam para duplicatas esvaziadas não servem às próximas entradas
+    for key in added:
+        if seen[key] in remap:
+            del seen[key]
+
+    if not remap:
+        return
+    for xref, source in sources.items():
+        if xref in remap:
+            continue
+        updated = remapped(source)
+        if updated != source:
+            doc.update_object(xref, updated)
+    for xref in remap:
+        if xref in stream_digests:
+            doc.update_stream(xref, b"")
+        doc.update_object(xref, "null")
+
+
+SPLIT_MODES = ("pages", "ranges", "every", "size")
+
+REF_RE = re.compile(rb"(\d+) 0 R")
+PARENT_RE = re.compile(rb"/Parent\s*\d+ 0 R")
+# Bytes que o save() de cada parte grava além do conteúdo dos objetos, usados
+# em mode=size: cabeçalho, catálogo, árvore de páginas, xref e trailer por
+# parte; "N 0 obj"/"endobj" e a entrada na xref por objeto ("stream"/"endstream"
+# a mais nos streams); a referência em /Kids e o /Parent por página
+SPLIT_PART_OVERHEAD = 512
+SPLIT_OBJECT_OVERHEAD = 48
+SPLIT_STREAM_OVERHEAD = 24
+SPLIT_PAGE_OVERHEAD = 24
+
+
+@tool("split-pdf", extensions={"pdf"}, modules=("fitz",), cost=linear_cost(8))
+def split_pdf(file, temp_dir, options=None):
+    """
+    Divide o PDF em partes. Opções (campo mode):
+    - pages (padrão): um arquivo por página
+    - ranges: intervalos explícitos em "ranges", ex.: "1-10,11-50"
+    - every: blocos de "every" páginas
+    - size: partes de até "max_mb" MB, com cortes estimados sem gravar candidatos
+      (uma página que sozinha passa do limite vira uma parte própria)
+    As partes são gravadas em paralelo, cada processo com o próprio documento.
+    """
+    options = options or {}
+    source = upload_source(file, temp_dir)
+
+    doc = open_pdf(source)
+    metrics.add_pages(len(doc))
+    try:
+        parts = split_parts(doc, options)
+    finally:
+        doc.close()
+
+    named_parts = [
+        (start, end, os.path.join(temp_dir, split_part_name(start, end)))
+        for start, end in parts
+    ]
+    tasks = [
+        (source, chunk)
+        for chunk in chunk_list(named_parts, app.config["PARALLEL_WORKERS"])
+        if chunk
+    ]
+    output_files = []
+    for chunk_files in parallel_map(_write_split_parts, tasks):
+        output_files.extend(chunk_files)
+    return output_files
+
+
+def split_parts(doc, options):
+    """Partes (início, fim), em base 0, pedidas pelas opções de split_pdf."""
+    mode = (options.get("mode") or "pages").lower()
+    if mode not in SPLIT_MODES:
+        raise ValueError(f"Modo de divisão não suportado: {mode}")
+
+    page_count = len(doc)
+    if mode == "pages":
+        parts = [(page_num, page_num) for page_num in range(page_count)]
+    elif mode == "ranges":
+        parts = _parse_split_ranges(options.get("ranges"), page_count)
+    elif mode == "every":
+        every = int_option(options, "every", 1, 1)
+        parts = [
+            (start, min(start + every, page_count) - 1)
+            for start in range(0, page_count, every)
+        ]
+    else:
+        max_mb = options.get("max_mb")
+        try:
+            max_bytes = float(max_mb) * 1024 * 1024
+        except (TypeError, ValueError):
+            raise ValueError(f"Valor inválido para max_mb: {max_mb}") from None
+        if max_bytes <= 0:
+            raise ValueError(f"Valor inválido para max_mb: {max_mb}")
+        parts = _split_points_by_size(doc, max_bytes)
+    return parts
+
+
+def split_part_name(start, end):
+    if start == end:
+        return f"page_{start + 1}.pdf"
+    return f"pages_{start + 1}-{end + 1}.pdf"
+
+
+def _parse_split_ranges(spec, page_count):
+    """
+    Cada item de "1-10,11-50" vira uma parte (início, fim) em base 0. Partes
+    sobrepostas são aceitas; repetidas, não (teriam o mesmo nome no zip).
+    """
+    if not spec or not spec.strip():
+        raise ValueError("Informe os intervalos para dividir, ex.: 1-10,11-50")
+    parts = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        pages = parse_page_ranges(item, page_count)
+        part = (pages[0], pages[-1])
+        if part in parts:
+            raise ValueError(f"Intervalo repetido em ranges: {item.strip()}")
+        parts.append(part)
+    return parts
+
+
+def _write_split_parts(task):
+    import fitz  # PyMuPDF
+
+    source, parts = task
+    output_files = []
+    doc = open_pdf(source)
+    try:
+        for start, end, output_path in parts:
+            new_doc = fitz.open()
+            new_doc.insert_pdf(doc, from_page=start, to_page=end)
+            new_doc.save(output_path)
+            new_doc.close()
+            output_files.append(output_path)
+    finally:
+        doc.close()
+    return output_files
+
+
+def _split_points_by_size(doc, max_bytes):
+    """
+    Agrupa páginas consecutivas enquanto o tamanho estimado da parte couber em
+    max_bytes. O tamanho de cada página é a soma dos objetos alcançáveis a partir
+    dela (conteúdo, fontes, imagens); objetos compartilhados contam uma vez por
+    parte. Cada objeto, página e parte soma também o que o save() acrescenta
+    (SPLIT_*_OVERHEAD).
+    """
+    page_xrefs = {doc.page_xref(page_num) for page_num in range(len(doc))}
+    object_sizes = {}
+    object_refs = {}
+
+    def object_size(xref):
+        if xref not in object_sizes:
+            source = doc.xref_object(xref, compressed=True).encode("latin-1", "ignore")
+            size = len(source) + SPLIT_OBJECT_OVERHEAD
+            if doc.xref_is_stream(xref):
+                size += SPLIT_STREAM_OVERHEAD
+                kind, value = doc.xref_get_key(xref, "Length")
+                if kind == "xref":
+                    value = doc.xref_object(int(value.split()[0]), compressed=True)
+                try:
+                    size += int(value)
+                except ValueError:
+                    pass
+            object_sizes[xref] = size
+            # /Parent leva à árvore de páginas inteira; não faz parte da página
+            object_refs[xref] = {
+                int(ref) for ref in REF_RE.findall(PARENT_RE.sub(b"", source))
+            }
+        return object_sizes[xref]
+
+    def reachable(page_xref):
+        seen, pending = set(), [page_xref]
+        while pending:
+            xref = pending.pop()
+            if xref in seen or xref <= 0 or xref >= doc.xref_length():
+                continue
+            # Links para outras páginas não trazem o conteúdo delas para a parte
+            if xref != page_xref and xref in page_xrefs:
+                continue
+            seen.add(xref)
+            object_size(xref)
+            pending.extend(object_refs[xref])
+        return seen
+
+    parts = []
+    start, part_objects, part_size = 0, set(), SPLIT_PART_OVERHEAD
+    for page_num in range(len(doc)):
+        objects = reachable(doc.page_xref(page_num))
+        added = SPLIT_PAGE_OVERHEAD
+        added += sum(object_sizes[xref] for xref in objects - part_objects)
+        if page_num > start and part_size + added > max_bytes:
+            parts.append((start, page_num - 1))
+            start, part_objects, part_size = page_num, set(), SPLIT_PART_OVERHEAD
+            added = SPLIT_PAGE_OVERHEAD
+            added += sum(object_sizes[xref] for xref in objects)
+        part_objects |= objects
+        part_size += added
+    if len(doc):
+        parts.append((start, len(doc) - 1))
+    return parts
+
+
+# Predefinições de compressão: (DPI máximo das imagens, qualidade JPEG)
+COMPRESS_PRESETS = {
+    "screen": (72, 40),
+    "ebook": (150, 60),
+    "print": (300, 80),
+    "lossless": (None, None),
+}
+
+
+def pdf_save_options():
+    """
+    Opções do save() para uma saída compacta. Object streams só existem no
+    save() de versões mais novas do PyMuPDF.
+    """
+    import fitz  # PyMuPDF
+
+    options = {"garbage": 4, "deflate": True, "clean": True}
+    if "use_objstms" in inspect.signature(fitz.Document.save).parameters:
+        options["use_objstms"] = True
+    return options
+
+
+@tool(
+    "compress-pdf",
+    extensions={"pdf"},
+    modules=("fitz", "PIL.Image"),
+    heavy=True,
+    # Cada imagem é decodificada inteira antes de ser reduzida
+    cost=linear_cost(16, per_mb=3, per_image=4),
+)
+def compress_pdf(file, temp_dir, options=None):
+    """
+    Comprime o PDF reduzindo e recomprimindo em JPEG as imagens acima do DPI
+    da predefinição (preset: screen, ebook, print ou lossless). As imagens são
+    processadas em paralelo; as que ficariam maiores são mantidas como estão.
+    """
+    options = options or {}
+    target_dpi, quality = compress_preset(options)
+
+    source = upload_source(file, temp_dir)
+    doc = open_pdf(source)
+    metrics.add_pages(len(doc))
+    recompress_images(doc, source, target_dpi, quality)
+
+    output_path = os.path.join(temp_dir, "compressed.pdf")
+    doc.save(output_path, **pdf_save_options())
+    doc.close()
+
+    # Nunca devolve um arquivo maior que o original
+    original_size = (
+        len(source) if isinstance(source, bytes) else os.path.getsize(source)
+    )
+    if os.path.getsize(output_path) >= original_size:
+        if isinstance(source, bytes):
+            with open(output_path, "wb") as f:
+                f.write(source)
+        else:
+            shutil.copyfile(source, output_path)
+
+    return [output_path]
+
+
+def compress_preset(options):
+    """(DPI alvo, qualidade JPEG) da predefinição escolhida em options."""
+    preset = (options.get("preset") or "ebook").lower()
+    if preset not in COMPRESS_PRESETS:
+        raise ValueError(f"Predefinição de compressão não suportada: {preset}")
+    return COMPRESS_PRESETS[preset]
+
+
+def recompress_images(doc, source, target_dpi, quality):
+    """
+    Substitui no próprio doc as imagens acima do DPI alvo pela versão reduzida.
+    source (bytes ou caminho do mesmo PDF) é aberto pelos workers; com None,
+    o doc é serializado em memória, só se houver imagens a processar.
+    """
+    if not target_dpi:
+        return
+    tasks = _image_recompress_tasks(doc, target_dpi)
+    if not tasks:
+        return
+    if source is None:
+        # Sem garbage collection o tobytes() mantém os números de xref
+        source = doc.tobytes()
+    chunks = chunk_list(tasks, app.config["PARALLEL_WORKERS"])
+    jobs = [(source, chunk, quality) for chunk in chunks if chunk]
+    for results in parallel_map(_recompress_images, jobs):
+        for xref, data, width, height, colorspace in results:
+            doc.update_stream(xref, data, compress=0)
+            doc.xref_set_key(xref, "Filter", "/DCTDecode")
+            doc.xref_set_key(xref, "Width", str(width))
+            doc.xref_set_key(xref, "Height", str(height))
+            doc.xref_set_key(xref, "ColorSpace", colorspace)
+            doc.xref_set_key(xref, "BitsPerComponent", "8")
+            doc.xref_set_key(xref, "DecodeParms", "null")
+
+
+def _image_recompress_tasks(doc, target_dpi):
+    """
+    Lista (xref, escala) das imagens candidatas. A escala vem do menor DPI em
+    que a imagem aparece, para não perder resolução em nenhuma das ocorrências.
+    """
+    scales = {}
+    masks = set()
+    for page in doc:
+        for image in page.get_images(full=True):
+            xref, smask, width, height = image[:4]
+            masks.add(smask)
+            # Imagens com transparência ou muito pequenas não compensam. Uma
+            # /Mask em array (chave de cor) compara cores exatas, que o JPEG
+            # não preserva; uma /Mask em stream é outra forma de transparência
+            if smask or xref in masks or min(width, height) < 64:
+                continue
+            if doc.xref_get_key(xref, "Mask")[0] != "null":
+                continue
+            for rect in page.get_image_rects(xref):
+                if rect.is_empty:
+                    continue
+                dpi = min(width / (rect.width / 72), height / (rect.height / 72))
+                scale = min(1.0, target_dpi / dpi)
+                scales[xref] = max(scales.get(xref, 0.0), scale)
+            scales.setdefault(xref, 1.0)
+    return [(xref, scale) for xref, scale in scales.items() if xref not in masks]
+
+
+def _recompress_images(task):
+    """Executado nos workers: decodifica, reduz e recodifica um bloco de imagens."""
+    from PIL import Image
+
+    source, images, quality = task
+    doc = open_pdf(source)
+    results = []
+    try:
+        for xref, scale in images:
+            if doc.xref_get_key(xref, "ImageMask")[1] == "true":
+                continue
+            if doc.xref_get_key(xref, "Decode")[0] != "null":
+                continue
+            try:
+                info = doc.extract_image(xref)
+                if info["colorspace"] not in (1, 3):
+                    continue
+                img = Image.open(io.BytesIO(info["image"]))
+                img = img.convert("L" if info["colorspace"] == 1 else "RGB")
+            except Exception:
+                # Formatos que o Pillow não lê (ex.: JBIG2) ficam como estão
+                continue
+            if scale < 1.0:
+                size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+                img = img.resize(size, Image.LANCZOS)
+            buffer = io.BytesIO()
+            img.save(buffer, "JPEG", quality=quality, optimize=True)
+            data = buffer.getvalue()
+            if len(data) >= len(doc.xref_stream_raw(xref)):
+                continue
+            colorspace = "/DeviceGray" if img.mode == "L" else "/DeviceRGB"
+            results.append((xref, data, img.width, img.height, colorspace))
+    finally:
+        doc.close()
+    return results
+
+
+GS_BINARY = shutil.which("gs") or shutil.which("gswin64c") or shutil.which("gswin32c")
+PDFA_PART_RE = re.compile(r"pdfaid:part\s*(?:=\s*[\"']|>)\s*(\d)")
+
+# A API em processo do Ghostscript usa uma instância global: uma conversão por vez
+_gs_api_lock = threading.Lock()
+
+
+@tool(
+    "pdf-to-pdfa",
+    extensions={"pdf"},
+    modules=("fitz",),
+    multiple=True,
+    heavy=True,
+    # Processos gs em paralelo, um por arquivo
+    cost=linear_cost(64, per_mb=4),
+)
+def pdf_to_pdfa(files, temp_dir, options=None):
+    """
+    Converte um ou mais PDFs para PDF/A-1b usando Ghostscript. Cada arquivo
+    roda em um processo gs próprio, em paralelo e com tempo limite; arquivos
+    que já declaram conformidade PDF/A nos metadados XMP são copiados como estão.
+    """
+    if not isinstance(files, list):
+        files = [files]
+
+    conversions = []
+    output_files = []
+    for file in files:
+        # Ghostscript só lê arquivos; uploads já em disco são usados no lugar
+        input_path = upload_path(file, temp_dir)
+
+        base_name, _ = os.path.splitext(secure_filename(file.filename))
+        output_path = os.path.join(temp_dir, f"{base_name}_pdfa.pdf")
+        output_files.append(output_path)
+
+        if _is_pdfa(input_path):
+            shutil.copyfile(input_path, output_path)
+            continue
+        conversions.append((file.filename, input_path, output_path))
+
+    run_ghostscript_batch(conversions)
+    return output_files
+
+
+def run_ghostscript_batch(conversions):
+    """Converte cada (nome, entrada, saída) para PDF/A em paralelo, no pool do gs."""
+    pool = _get_pool(
+        "ghostscript",
+        ThreadPoolExecutor,
+        max_workers=app.config["GHOSTSCRIPT_WORKERS"],
+    )
+    futures = [
+        (filename, pool.submit(_run_ghostscript, input_path, output_path))
+        for filename, input_path, output_path in conversions
+    ]
+    try:
+        for filename, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                raise RuntimeError(
+                    f"Erro ao converter {filename} para PDF/A: {e}"
+                ) from e
+    finally:
+        for _, future in futures:
+            future.cancel()
+
+
+def _is_pdfa(pdf_path):
+    """Indica se os metadados XMP do arquivo já declaram conformidade PDF/A."""
+    import fitz  # PyMuPDF
+
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception:
+        return False
+    try:
+        return declares_pdfa(doc)
+    finally:
+        doc.close()
+
+
+def declares_pdfa(doc):
+    return bool(PDFA_PART_RE.search(doc.get_xml_metadata() or ""))
+
+
+def _run_ghostscript(input_path, output_path):
+    gs_args = [
+        GS_BINARY or "gs",
+        "-dPDFA=1",
+        "-dBATCH",
+        "-dNOPAUSE",
+        "-dNOOUTERSAVE",
+        "-dUseCIEColor",
+        "-sProcessColorModel=DeviceRGB",
+        "-sDEVICE=pdfwrite",
+        "-sColorConversionStrategy=UseDeviceIndependentColor",
+        "-dPDFACompatibilityPolicy=1",
+        f"-sOutputFile={output_path}",
+        input_path,
+    ]
+
+    if GS_BINARY is None:
+        # Sem o executável, usa a API em processo (serializada)
+        import ghostscript
+
+        gs_args = [arg.encode("utf-8") for arg in gs_args]
+        with _gs_api_lock:
+            ghostscript.Ghostscript(*gs_args)
+        return
+
+    timeout = app.config["GHOSTSCRIPT_TIMEOUT"]
+    try:
+        result = subprocess.run(
+            gs_args[:1] + ["-q"] + gs_args[1:],
+            capture_output=True,
+            timeout=timeout,
+            check=False,
+        )
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"tempo limite de {timeout}s excedido") from None
+    if result.returncode != 0:
+        message = result.stderr.decode("utf-8", "replace").strip()
+        raise RuntimeError(
+            message or f"Ghostscript terminou com código {result.returncode}"
+        )
+
+
+PIPELINE_STEPS = (
+    "merge-pdf",
+    "split-pdf",
+    "compress-pdf",
+    "pdf-to-pdfa",
+    "pdf-to-images",
+)
+
+
+@tool(
+    "pipeline",
+    extensions={"pdf"},
+    modules=("fitz", "PIL.Image"),
+    multiple=True,
+    heavy=True,
+    cost=linear_cost(32, per_mb=4, per_page=0.5, per_image=4),
+)
+def pipeline(files, temp_dir, options=None):
+    """
+    Executa várias ferramentas de PDF em sequência numa só requisição. Os
+    documentos ficam abertos em memória entre as etapas e só são gravados no
+    fim (ou quando o Ghostscript precisa de um arquivo). Campo steps:
+    - nomes separados por vírgula, ex.: "merge-pdf,compress-pdf"; as demais
+      opções do formulário valem para todas as etapas
+    - ou uma lista JSON, ex.: '[{"tool": "split-pdf", "mode": "every",
+      "every": 10}, "pdf-to-images"]', com opções próprias por etapa
+    pdf-to-images, se usada, precisa ser a última etapa.
+    """
+    steps = _parse_pipeline_steps(options or {})
+    output_dir = os.path.join(temp_dir, "pipeline")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Cada item é [nome de saída, documento aberto, arquivo já gravado ou None]
+    documents = []
+    try:
+        for file in files:
+            doc = open_pdf(upload_source(file, temp_dir))
+            metrics.add_pages(len(doc))
+            documents.append([secure_filename(file.filename), doc, None])
+
+        for name, step_options in steps:
+            if name == "pdf-to-images":
+                return _pipeline_images(documents, output_dir, step_options)
+            documents = PIPELINE_HANDLERS[name](documents, temp_dir, step_options)
+        return _pipeline_save(documents, output_dir)
+    finally:
+        for _, doc, _ in documents:
+            if not doc.is_closed:
+                doc.close()
+
+
+def _parse_pipeline_steps(options):
+    """Lista de (etapa, opções) a partir de options["steps"]."""
+    spec = (options.get("steps") or "").strip()
+    shared = {key: value for key, value in options.items() if key != "steps"}
+    if spec.startswith("["):
+        try:
+            items = json.loads(spec)
+        except ValueError:
+            raise ValueError("Lista de etapas inválida em steps") from None
+    else:
+        items = [name.strip() for name in spec.split(",") if name.strip()]
+    if not items:
+        raise ValueError("Informe as etapas do pipeline em steps")
+
+    steps = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"tool": item}
+        name = item.get("tool") if isinstance(item, dict) else item
+        if name not in PIPELINE_STEPS:
+            raise ValueError(f"Etapa de pipeline não suportada: {name}")
+        step_options = dict(shared)
+        # Valores do JSON viram texto, como os campos do formulário
+        step_options.update(
+            {key: str(value) for key, value in item.items() if key != "tool"}
+        )
+        steps.append((name, step_options))
+
+    if any(name == "pdf-to-images" for name, _ in steps[:-1]):
+        raise ValueError("pdf-to-images só pode ser a última etapa do pipeline")
+    return steps
+
+
+def _pipeline_merge(documents, temp_dir, options):
+    specs = merge_page_specs(options.get("page_ranges"), len(documents))
+    merged_doc = merge_documents(
+        ((name, doc) for name, doc, _ in documents), specs, options
+    )
+    return [["merged.pdf", merged_doc, None]]
+
+
+def _pipeline_split(documents, temp_dir, options):
+    import fitz  # PyMuPDF
+
+    parts = []
+    for name, doc, _ in documents:
+        # Com vários documentos, o nome de origem evita partes homônimas
+        prefix = os.path.splitext(name)[0] + "_" if len(documents) > 1 else ""
+        for start, end in split_parts(doc, options):
+            part = fitz.open()
+            part.insert_pdf(doc, from_page=start, to_page=end)
+            parts.append([prefix + split_part_name(start, end), part, None])
+        doc.close()
+    return parts
+
+
+def _pipeline_compress(documents, temp_dir, options):
+    target_dpi, quality = compress_preset(options)
+    for item in documents:
+        # Os workers recebem o documento serializado em memória
+        recompress_images(item[1], None, target_dpi, quality)
+        item[2] = None
+    return documents
+
+
+def _pipeline_pdfa(documents, temp_dir, options):
+    import fitz  # PyMuPDF
+
+    conversions = []
+    for index, item in enumerate(documents):
+        name, doc, saved = item
+        if declares_pdfa(doc):
+            continue
+        # O Ghostscript só lê arquivos: grava o estado atual, se ainda não gravado
+        input_path = saved
+        if input_path is None:
+            input_path = os.path.join(temp_dir, f"pipeline_{index}.pdf")
+            doc.save(input_path, **pdf_save_options())
+        base_name, _ = os.path.splitext(name)
+        output_path = os.path.join(temp_dir, f"pipeline_{index}_pdfa.pdf")
+        conversions.append(
+            (name, input_path, output_path, item, f"{base_name}_pdfa.pdf")
+        )
+
+    run_ghostscript_batch([conversion[:3] for conversion in conversions])
+    for _, input_path, output_path, item, output_name in conversions:
+        item[1].close()
+        if input_path != item[2]:
+            os.remove(input_path)
+        # O resultado do gs já está gravado: sem nova etapa, vai como está
+        item[:] = [output_name, fitz.open(output_path), output_path]
+    return documents
+
+
+def _pipeline_images(documents, output_dir, options):
+    output_files = []
+    for name, doc, saved in documents:
+        pages = parse_page_ranges(options.get("pages"), len(doc))
+        prefix = "page"
+        if len(documents) > 1:
+            prefix = f"{os.path.splitext(name)[0]}_page"
+        # Os processos de renderização abrem o documento a partir da memória
+        source = saved or doc.tobytes()
+        output_files.extend(
+            render_images(source, pages, output_dir, options, prefix=prefix)
+        )
+    return output_files
+
+
+def _pipeline_save(documents, output_dir):
+    output_files = []
+    for name, doc, saved in documents:
+        output_path = os.path.join(output_dir, name)
+        if saved is None:
+            doc.save(output_path, **pdf_save_options())
+        else:
+            doc.close()
+            os.replace(saved, output_path)
+        output_files.append(output_path)
+    return output_files
+
+
+PIPELINE_HANDLERS = {
+    "merge-pdf": _pipeline_merge,
+    "split-pdf": _pipeline_split,
+    "compress-pdf": _pipeline_compress,
+    "pdf-to-pdfa": _pipeline_pdfa,
+}
+
+
+@tool(
+    "word-to-pdf",
+    extensions={"docx"},
+    modules=("docx", "fitz", "reportlab.pdfgen.canvas", "layout"),
+    multiple=True,
+    heavy=True,
+    cost=linear_cost(32, per_mb=10),
+)
+def word_to_pdf(files, temp_dir, options=None):
+    """
+    Converte um ou múltiplos arquivos DOCX para PDF
+    Se houver múltiplos arquivos, mescla todos em um único PDF. Cada documento
+    é renderizado em um processo próprio e os segmentos são unidos em ordem.
+    """
+    # Se for apenas um arquivo (compatibilidade)
+    if not isinstance(files, list):
+        files = [files]
+
+    tasks = [
+        (
+            upload_source(file, temp_dir),
+            file.filename,
+            file_idx,
+            os.path.join(temp_dir, f"word_segment_{file_idx}.pdf"),
+        )
+        for file_idx, file in enumerate(files)
+    ]
+    segments = parallel_map(_render_docx, tasks)
+
+    # Criar PDF de saída
+    pdf_path = os.path.join(temp_dir, "word_to_pdf.pdf")
+    merge_segments(segments, pdf_path)
+    return [pdf_path]
+
+
+def _render_docx(task):
+    """
+    Renderiza um DOCX percorrendo o corpo uma única vez, na ordem original de
+    parágrafos e tabelas.
+    """
+    from docx import Document
+    from docx.oxml.ns import qn
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    from layout import TextWriter
+
+    source, filename, file_idx, segment_path = task
+
+    # Lê o documento Word
+    doc = Document(as_file(source))
+    writer = TextWriter(
+        lambda: canvas.Canvas(segment_path, pagesize=letter), font_size=11, leading=20
+    )
+
+    # Adicionar separador visual (exceto no primeiro documento)
+    if file_idx > 0:
+        # Adicionar cabeçalho com nome do arquivo
+        writer.set_font("Helvetica-Bold", 12, leading=20)
+        writer.write_line(f"{'=' * 60}")
+        writer.write_line(f"Documento: {filename}")
+        writer.write_line(f"{'=' * 60}")
+        writer.skip(10)
+        writer.set_font("Helvetica", 11, leading=20)
+
+    for child in doc.element.body.iterchildren():
+        if child.tag == qn("w:p"):
+            # Quebra texto longo em múltiplas linhas
+            paragraph = Paragraph(child, doc)
+            if paragraph.text.strip():
+                writer.write_wrapped(paragraph.text)
+
+        elif child.tag == qn("w:tbl"):
+            # Adicionar espaçamento antes da tabela
+            writer.skip(10)
+            writer.ensure_space(50)
+
+            # Desenhar linhas da tabela
+            writer.set_font("Helvetica", 9, leading=15)
+            for row in Table(child, doc).rows:
+                writer.write_truncated(" | ".join([cell.text for cell in row.cells]))
+
+            # Espaçamento após tabela
+            writer.skip(10)
+            writer.set_font("Helvetica", 11, leading=20)
+
+    writer.close()
+    return segment_path
+
+
+TEXT_ENGINES = ("fitz", "pdfplumber")
+TEXT_FORMATS = {
+    "text": ("txt", "text/plain; charset=utf-8"),
+    "jsonl": ("jsonl", "application/x-ndjson"),
+}
+# Páginas por tarefa: blocos pequenos mantêm o streaming fluido
+TEXT_CHUNK_PAGES = 16
+
+
+def stream_pdf_text(file, temp_dir, options=None):
+    """
+    Extrai o texto das páginas em paralelo (blocos de páginas por processo)
+    e devolve (nome, mimetype, iterador de bytes) página a página, em ordem.
+    Opções: engine (fitz, padrão e mais rápido; pdfplumber, respeita o layout),
+    format (text, com as páginas separadas por \\f; jsonl, uma linha
+    {"page", "text"} por página), pages (ex.: "1-3,7") e sort=1 (fitz: ordena
+    os blocos em ordem de leitura).
+    """
+    options = options or {}
+    engine = (options.get("engine") or "fitz").lower()
+    if engine not in TEXT_ENGINES:
+        raise ValueError(f"Engine de extração não suportada: {engine}")
+    output = (options.get("format") or "text").lower()
+    if output not in TEXT_FORMATS:
+        raise ValueError(f"Formato de texto não suportado: {output}")
+    if engine == "pdfplumber":
+        try:
+            import pdfplumber  # noqa: F401
+        except ImportError:
+            raise ValueError("engine=pdfplumber requer o pacote pdfplumber") from None
+    sort = bool_option(options, "sort")
+
+    # Os processos abrem o arquivo pelo caminho, sem receber o PDF a cada
+    # bloco. O upload temporário é apagado ao fim da requisição, antes de o
+    # streaming terminar: fica uma cópia (ou hard link) em temp_dir
+    source = os.path.join(temp_dir, "source.pdf")
+    uploaded = upload_source(file, temp_dir)
+    if not isinstance(uploaded, str):
+        with open(source, "wb") as f:
+            f.write(uploaded)
+    elif os.path.abspath(uploaded) != os.path.abspath(source):
+        _link_or_copy(uploaded, source)
+    doc = open_pdf(source)
+    pages = parse_page_ranges(options.get("pages"), len(doc))
+    doc.close()
+    metrics.add_pages(len(pages))
+
+    tasks = [
+        (source, pages[start : start + TEXT_CHUNK_PAGES], engine, sort)
+        for start in range(0, len(pages), TEXT_CHUNK_PAGES)
+    ]
+    extension, mimetype = TEXT_FORMATS[output]
+    base_name, _ = os.path.splitext(secure_filename(file.filename))
+    return f"{base_name}.{extension}", mimetype, _iter_text(tasks, output)
+
+
+def _iter_text(tasks, output):
+    for results in parallel_imap(_extract_text, tasks):
+        if output == "jsonl":
+            lines = [
+                json.dumps({"page": page_num + 1, "text": text}, ensure_ascii=False)
+                + "\n"
+                for page_num, text in results
+            ]
+        else:
+            lines = [text + "\f" for _, text in results]
+        yield "".join(lines).encode("utf-8")
+
+
+def _extract_text(task):
+    source, pages, engine, sort = task
+    if engine == "pdfplumber":
+        import pdfplumber
+
+        results = []
+        # pages limita o que o pdfplumber carrega às páginas do bloco
+        with pdfplumber.open(source, pages=[n + 1 for n in pages]) as pdf:
+            for page_num, page in zip(pages, pdf.pages):
+                results.append((page_num, page.extract_text(layout=True) or ""))
+                page.flush_cache()
+        return results
+
+    doc = open_pdf(source)
+    try:
+        return [(n, doc.load_page(n).get_text(sort=sort)) for n in pages]
+    finally:
+        doc.close()
+
+
+@tool(
+    "pdf-to-text",
+    extensions={"pdf"},
+    modules=("fitz",),
+    heavy=True,
+    cost=linear_cost(16, per_mb=2),
+    stream=stream_pdf_text,
+)
+def pdf_to_text(file, temp_dir, options=None):
+    """
+    Texto do PDF em .txt ou .jsonl (ver stream_pdf_text). Usado pelos modos
+    assíncrono e batch; /convert síncrono envia o texto em streaming.
+    """
+    filename, _, chunks = stream_pdf_text(file, temp_dir, options)
+    output_path = os.path.join(temp_dir, filename)
+    with open(output_path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    return [output_path]
+
+
+@tool(
+    "pdf-to-word",
+    extensions={"pdf"},
+    modules=("fitz", "pdf2docx"),
+    heavy=True,
+    # pdf2docx guarda o layout de todas as páginas em memória
+    cost=linear_cost(96, per_mb=4, per_page=2),
+)
+def pdf_to_word(file, temp_dir, options=None):
     """
     Convert PDF to Word (.docx) format.
+
+    Opções: pages ("1-3,7") ou start/end (base 1, inclusivos); parallel=1 liga
+    o multiprocessamento do pdf2docx com workers processos (só para páginas
+    contínuas). A conversão roda num processo próprio, encerrado ao passar de
+    PDF_TO_WORD_TIMEOUT segundos.
     """
-    pdf_path = os.path.join(temp_dir, secure_filename(file.filename))
-    file.save(pdf_path)
+    import fitz  # PyMuPDF
+
+    options = options or {}
+    pdf_path = os.path.abspath(upload_path(file, temp_dir))
+
+    doc = fitz.open(pdf_path)
+    page_count = len(doc)
+    doc.close()
+
+    if options.get("pages"):
+        pages = parse_page_ranges(options["pages"], page_count)
+    else:
+        start = int_option(options, "start", 1, 1, page_count)
+        end = int_option(options, "end", page_count, start, page_count)
+        pages = list(range(start - 1, end))
+    if not pages:
+        raise ValueError("Nenhuma página selecionada")
+
+    settings = {}
+    contiguous = pages == list(range(pages[0], pages[-1] + 1))
+    if contiguous:
+        settings.update(start=pages[0], end=pages[-1] + 1)
+    else:
+        settings.update(pages=pages)
+    if contiguous and bool_option(options, "parallel"):
+        workers = int_option(
+            options, "workers", app.config["PARALLEL_WORKERS"], 1, os.cpu_count()
+        )
+        settings.update(multi_processing=True, cpu_count=workers)
 
     docx_filename = os.path.splitext(secure_filename(file.filename))[0] + ".docx"
-    docx_path = os.path.join(temp_dir, docx_filename)
+    docx_path = os.path.join(os.path.abspath(temp_dir), docx_filename)
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=_pdf_to_word_process,
+        args=(pdf_path, docx_path, file.filename, settings, sender),
+    )
+    process.start()
+    sender.close()
+
+    timeout = app.config["PDF_TO_WORD_TIMEOUT"]
+    try:
+        if not receiver.poll(timeout):
+            _kill_process_tree(process)
+            raise RuntimeError(
+                f"Tempo limite de {timeout}s excedido ao converter "
+                f"{file.filename} para Word"
+            )
+        try:
+            error = receiver.recv()
+        except EOFError:
+            error = (
+                f"Erro ao converter {file.filename} para Word: processo "
+                "encerrado inesperadamente"
+            )
+    finally:
+        receiver.close()
+        process.join()
+
+    if error:
+        raise RuntimeError(error)
+    metrics.add_pages(len(pages))
+    return [docx_path]
+
+
+def _pdf_to_word_process(pdf_path, docx_path, filename, settings, sender):
+    """Executa o pdf2docx e devolve None ou a mensagem de erro pelo pipe."""
+    from pdf2docx import Converter
+    from pdf2docx.converter import ConversionException
+
+    # Grupo de processos próprio: no timeout, o pool do pdf2docx cai junto
+    if hasattr(os, "setsid"):
+        os.setsid()
+    # O modo paralelo grava pages-N.json no diretório atual
+    os.chdir(os.path.dirname(docx_path))
 
     cv = None
+    error = None
     try:
         cv = Converter(pdf_path)
-        cv.convert(docx_path)
+        cv.convert(docx_path, **settings)
     except ValueError as e:
-        raise RuntimeError(f"Erro no arquivo PDF: {e}") from e
+        error = f"Erro no arquivo PDF: {e}"
     except ConversionException as e:
-        raise RuntimeError(f"Erro interno na conversão: {e}") from e
+        error = f"Erro interno na conversão: {e}"
     except Exception as e:
-        raise RuntimeError(f"Erro ao converter {file.filename} para Word: {e}") from e
+        error = f"Erro ao converter {filename} para Word: {e}"
     finally:
         if cv:
             cv.close()
+    sender.send(error)
+    sender.close()
 
-    return [docx_path]
 
+def _kill_process_tree(process):
+    """Mata o processo e, quando possível, todo o seu grupo."""
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+            return
+        except ProcessLookupError:
+            # Ainda não criou o próprio grupo
+            pass
+    process.kill()
+
+
+# Formatos que já chegam comprimidos: deflate só gastaria CPU
+STORED_EXTENSIONS = {"png", "jpg", "jpeg", "webp", "docx", "xlsx", "zip", "gz"}
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def _is_compressed(file_path):
+    """Indica se vale gravar o arquivo sem compressão (ZIP_STORED) no zip."""
+    if file_path.rsplit(".", 1)[-1].lower() in STORED_EXTENSIONS:
+        return True
+    # PDFs com streams já comprimidos quase não diminuem; testa uma amostra
+    with open(file_path, "rb") as f:
+        sample = f.read(64 * 1024)
+    if len(sample) < 1024:
+        return False
+    return len(zlib.compress(sample, 1)) > len(sample) * 0.9
+
+
+class _ZipStreamBuffer:
+    """Destino somente-escrita do ZipFile; os bytes são drenados a cada chunk."""
+
+    def __init__(self):
+        self._chunks = []
 
-def build_response(output_files, temp_dir):
-    """Monta resposta enviando arquivos como attachment sem risco de remoção prematura do diretório temporário."""
-    if len(output_files) == 1:
-        file_path = output_files[0]
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(output_files):
+    """
+    Gera o zip em pedaços enquanto lê cada membro do disco (memória constante).
+    Cada item é um caminho ou um par (caminho, nome no zip).
+    """
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, "w") as zipf:
+        for item in output_files:
+            if isinstance(item, tuple):
+                file_path, arcname = item
+            else:
+                file_path, arcname = item, os.path.basename(item)
+            zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+            zinfo.compress_type = (
+                zipfile.ZIP_STORED
+                if _is_compressed(file_path)
+                else zipfile.ZIP_DEFLATED
+            )
+            with open(file_path, "rb") as src, zipf.open(zinfo, "w") as dst:
+                while chunk := src.read(STREAM_CHUNK_SIZE):
+                    dst.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def build_response(output_files, stages=None):
+    """
+    Envia o resultado direto do disco: um único arquivo vai como attachment e
+    vários são compactados em streaming, sem montar o zip inteiro antes.
+    Com stages, registra em stages["archive"] o tempo gasto montando o zip.
+    output_files pode ser também um gerador (modo batch), sempre enviado em zip.
+    """
+    if (
+        isinstance(output_files, list)
+        and len(output_files) == 1
+        and isinstance(output_files[0], str)
+    ):
+        file_path = os.path.abspath(output_files[0])
         filename = os.path.basename(file_path)
-        with open(file_path, "rb") as f:
-            data = f.read()
-        return send_file(io.BytesIO(data), as_attachment=True, download_name=filename)
-    else:
-        zip_path = os.path.join(temp_dir, "converted_files.zip")
-        with zipfile.ZipFile(zip_path, "w") as zipf:
-            for file_path in output_files:
-                zipf.write(file_path, os.path.basename(file_path))
-        with open(zip_path, "rb") as f:
-            data = f.read()
-        return send_file(
-            io.BytesIO(data), as_attachment=True, download_name="converted_files.zip"
-        )
+        response = send_file(file_path, as_attachment=True, download_name=filename)
+        # O send_file devolve a resposta em direct_passthrough: o servidor só
+        # fecha o arquivo e nunca chama Response.close(), então os callbacks
+        # de call_on_close (remoção do temp_dir, métricas) não rodariam
+        response.direct_passthrough = False
+        return response
+
+    chunks = stream_zip(output_files)
+    if stages is not None:
+
+        def record_archive(seconds):
+            # Um gerador (batch) converte enquanto o zip é montado: essa espera
+            # já está em stages["convert"] e fica fora do tempo do zip
+            if not isinstance(output_files, list):
+                seconds -= stages.get("convert", 0)
+            stages["archive"] = seconds
+
+        chunks = metrics.timed_iter(chunks, record_archive)
+    response = Response(chunks, mimetype="application/zip")
+    response.headers.set(
+        "Content-Disposition", "attachment", filename="converted_files.zip"
+    )
+    return response
 
 
 if __name__ == "__main__":
@@ -0,0 +1,153 @@
+"""
+Gerador do corpus sintético dos benchmarks.
+
+Cada fixture é determinística (sementes fixas) e fica em cache no diretório
+do corpus: o nome do arquivo inclui o tipo e o tamanho, então só é gerada na
+primeira execução.
+"""
+
+import io
+import os
+import random
+
+import fitz  # PyMuPDF
+import openpyxl
+from docx import Document
+from PIL import Image, ImageDraw
+
+CORPUS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua relatório contrato "
+    "página documento planilha análise resultado período cliente valor total"
+).split()
+
+
+def _sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _photo(rng, width, height):
+    """Imagem com gradiente e formas aleatórias, parecida com uma foto comprimida."""
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(60):
+        x, y = rng.randrange(width), rng.randrange(height)
+        size = rng.randrange(width // 20, width // 4)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x, y, x + size, y + size), fill=color)
+    return image
+
+
+def text_pdf(path, pages):
+    rng = random.Random(1)
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        lines = [f"Página {number + 1}"]
+        lines += [_sentence(rng, 12) for _ in range(45)]
+        page.insert_text((50, 60), "\n".join(lines), fontsize=10)
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+
+
+def scan_pdf(path, pages):
+    """Páginas que são só uma imagem JPEG em 200 DPI, como um documento escaneado."""
+    rng = random.Random(2)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        buffer = io.BytesIO()
+        _photo(rng, 1700, 2200).save(buffer, format="JPEG", quality=85)
+        page.insert_image(page.rect, stream=buffer.getvalue())
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+
+
+def xlsx(path, rows):
+    rng = random.Random(3)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Dados")
+    sheet.append(["id", "cliente", "descrição", "quantidade", "valor", "total"])
+    for row in range(rows):
+        quantity = rng.randrange(1, 100)
+        price = round(rng.uniform(1, 500), 2)
+        sheet.append(
+            [
+                row + 1,
+                rng.choice(WORDS),
+                _sentence(rng, 4),
+                quantity,
+                price,
+                round(quantity * price, 2),
+            ]
+        )
+    workbook.save(path)
+
+
+def docx(path, paragraphs):
+    """Documento longo com parágrafos e uma tabela a cada 50 parágrafos."""
+    rng = random.Random(4)
+    document = Document()
+    for idx in range(paragraphs):
+        if idx % 50 == 0:
+            document.add_heading(f"Seção {idx // 50 + 1}", level=1)
+        document.add_paragraph(_sentence(rng, rng.randrange(20, 80)))
+        if idx % 50 == 49:
+            table = document.add_table(rows=10, cols=4)
+            for cell in table._cells:
+                cell.text = _sentence(rng, 3)
+    document.save(path)
+
+
+def txt(path, lines):
+    rng = random.Random(5)
+    with open(path, "w", encoding="utf-8") as f:
+        for idx in range(lines):
+            f.write(f"{idx:08d} INFO {_sentence(rng, rng.randrange(5, 30))}\n")
+
+
+def photos(path_prefix, count):
+    """Lote de fotos JPEG; devolve a lista de caminhos."""
+    paths = []
+    for idx in range(count):
+        path = f"{path_prefix}_{idx + 1}.jpg"
+        if not os.path.exists(path):
+            # Semente por foto: o lote maior repete as fotos do menor
+            _photo(random.Random(600 + idx), 3000, 2000).save(
+                path + ".partial", format="JPEG", quality=90
+            )
+            os.replace(path + ".partial", path)
+        paths.append(path)
+    return paths
+
+
+# Tipo de fixture -> (gerador, extensão, quantidade base multiplicada pela escala)
+KINDS = {
+    "text_pdf": (text_pdf, "pdf", 10),
+    "scan_pdf": (scan_pdf, "pdf", 2),
+    "xlsx": (xlsx, "xlsx", 5000),
+    "docx": (docx, "docx", 200),
+    "txt": (txt, "txt", 20000),
+    "photos": (photos, "jpg", 2),
+}
+
+
+def fixture(kind, scale):
+    """Caminhos dos arquivos da fixture, gerando-os se ainda não existirem."""
+    generator, extension, base = KINDS[kind]
+    amount = base * scale
+    os.makedirs(CORPUS_FOLDER, exist_ok=True)
+    name = os.path.join(CORPUS_FOLDER, f"{kind}_{amount}")
+
+    if kind == "photos":
+        return generator(os.path.join(CORPUS_FOLDER, "photo"), amount)
+
+    path = f"{name}.{extension}"
+    if not os.path.exists(path):
+        # Grava em outro nome e renomeia: uma geração interrompida não fica no cache
+        partial = f"{name}.partial.{extension}"
+        generator(partial, amount)
+        os.replace(partial, path)
+    return [path]
@@ -0,0 +1,234 @@
+"""
+Benchmarks das ferramentas de /convert sobre o corpus sintético.
+
+Cada caso (ferramenta x tamanho) roda num subprocesso próprio, para que o pico
+de memória (RSS) medido seja só daquele caso. O resultado vai para um JSON e é
+comparado com a baseline salva, sinalizando regressões acima da tolerância.
+
+Uso (na raiz do repositório):
+    python benchmarks/run.py                        # todos os casos
+    python benchmarks/run.py --tools split-pdf --sizes small,medium
+    python benchmarks/run.py --save-baseline        # grava a baseline local
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import corpus  # noqa: E402
+
+# Multiplicador das quantidades base de cada fixture (ver corpus.KINDS)
+SIZES = {"small": 1, "medium": 4, "large": 16}
+
+# Ferramenta -> (fixtures enviadas, opções do formulário)
+CASES = {
+    "pdf-to-images": (["text_pdf"], {}),
+    "merge-pdf": (["text_pdf", "scan_pdf"], {}),
+    "split-pdf": (["text_pdf"], {}),
+    "compress-pdf": (["scan_pdf"], {}),
+    "pdf-to-pdfa": (["text_pdf"], {}),
+    "word-to-pdf": (["docx"], {}),
+    "excel-to-pdf": (["xlsx"], {}),
+    "txt-to-pdf": (["txt"], {}),
+    "pdf-to-word": (["text_pdf"], {}),
+    "pdf-to-text": (["text_pdf"], {}),
+    "images-to-pdf": (["photos"], {}),
+    "pipeline": (["text_pdf", "scan_pdf"], {"steps": "merge-pdf,compress-pdf"}),
+}
+
+# Métricas comparadas com a baseline (maior é pior)
+METRICS = ("wall_s", "peak_rss_mb", "output_bytes")
+# Diferenças absolutas abaixo disto são ruído (casos de poucos milissegundos)
+MIN_DELTA = {"wall_s": 0.05, "peak_rss_mb": 5, "output_bytes": 0}
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+RESULTS_FOLDER = os.path.join(BENCH_DIR, "results")
+
+
+def _peak_rss_mb():
+    """Pico de RSS deste processo mais o maior pico entre os filhos."""
+    import resource
+
+    # ru_maxrss vem em KB no Linux e em bytes no macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round((own + children) * unit / (1024 * 1024), 1)
+
+
+def run_case_inline(tool, paths, options):
+    """Executa uma conversão pelo cliente de teste do Flask (modo --worker)."""
+    sys.path.insert(0, ROOT_DIR)
+    import app as localpdf
+
+    client = localpdf.app.test_client()
+    handles = [open(path, "rb") for path in paths]
+    try:
+        data = dict(options, tool=tool)
+        data["files"] = [(f, os.path.basename(f.name)) for f in handles]
+        start = time.perf_counter()
+        response = client.post("/convert", data=data)
+        # Consome a resposta em blocos, como um cliente real (zip em streaming)
+        output_bytes = 0
+        head = b""
+        for chunk in response.response:
+            output_bytes += len(chunk)
+            if len(head) < 500:
+                head += chunk[:500]
+        wall = time.perf_counter() - start
+        response.close()
+    finally:
+        for f in handles:
+            f.close()
+
+    result = {
+        "status": response.status_code,
+        "wall_s": round(wall, 3),
+        "peak_rss_mb": _peak_rss_mb(),
+        "output_bytes": output_bytes,
+    }
+    if response.status_code != 200:
+        result["error"] = head.decode("utf-8", "replace")[:500]
+    return result
+
+
+def run_case(tool, size, repeat):
+    """Roda o caso em subprocessos novos; fica com a mediana do tempo."""
+    kinds, options = CASES[tool]
+    paths = [path for kind in kinds for path in corpus.fixture(kind, SIZES[size])]
+
+    runs = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as work_dir:
+            # Diretório de trabalho próprio: uploads/ e outputs/ do app ficam nele
+            env = dict(os.environ, LOCALPDF_CACHE_MAX_BYTES="0")
+            completed = subprocess.run(
+                [sys.executable, __file__, "--worker", tool, json.dumps(paths)],
+                cwd=work_dir,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=False,
+            )
+        if completed.returncode != 0:
+            return {"status": None, "error": completed.stderr.strip()[-500:]}
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        if runs[-1]["status"] != 200:
+            return runs[-1]
+
+    result = dict(runs[-1])
+    result["wall_s"] = round(statistics.median(r["wall_s"] for r in runs), 3)
+    result["peak_rss_mb"] = max(r["peak_rss_mb"] for r in runs)
+    result["input_bytes"] = sum(os.path.getsize(path) for path in paths)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Lista as métricas que pioraram mais que a tolerância em relação à baseline."""
+    regressions = []
+    for case, current in results.items():
+        previous = baseline.get(case)
+        if not previous or current.get("status") != 200:
+            continue
+        for metric in METRICS:
+            before, after = previous.get(metric), current.get(metric)
+            if before is None or after is None:
+                continue
+            if after > before * (1 + tolerance) and after - before > MIN_DELTA[metric]:
+                regressions.append((case, metric, before, after))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tools", default=",".join(CASES))
+    parser.add_argument("--sizes", default="small,medium")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="JSON de saída (padrão: results/<data>.json)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="grava os resultados como nova baseline",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="piora relativa aceita antes de sinalizar regressão (padrão: 0.2)",
+    )
+    args = parser.parse_args()
+
+    tools = [tool for tool in args.tools.split(",") if tool]
+    sizes = [size for size in args.sizes.split(",") if size]
+    for tool in tools:
+        if tool not in CASES:
+            parser.error(f"ferramenta desconhecida: {tool}")
+    for size in sizes:
+        if size not in SIZES:
+            parser.error(f"tamanho desconhecido: {size}")
+
+    results = {}
+    for tool in tools:
+        for size in sizes:
+            case = f"{tool}:{size}"
+            result = results[case] = run_case(tool, size, max(1, args.repeat))
+            if result.get("status") == 200:
+                print(
+                    f"{case:28} {result['wall_s']:8.3f}s "
+                    f"{result['peak_rss_mb']:8.1f} MB {result['output_bytes']:>12} B"
+                )
+            else:
+                print(f"{case:28} FALHOU: {result.get('error', '').strip()[:200]}")
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        output = os.path.join(RESULTS_FOLDER, time.strftime("%Y%m%d-%H%M%S.json"))
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResultados em {output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline gravada em {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("Sem baseline para comparar (use --save-baseline)")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+
+    regressions = compare(results, baseline, args.tolerance)
+    for case, metric, before, after in regressions:
+        print(f"REGRESSÃO {case} {metric}: {before} -> {after}")
+    if not regressions:
+        print("Nenhuma regressão em relação à baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--worker":
+        tool, paths = sys.argv[2], json.loads(sys.argv[3])
+        print(json.dumps(run_case_inline(tool, paths, CASES[tool][1])))
+        sys.exit(0)
+    sys.exit(main())
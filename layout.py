@@ -0,0 +1,194 @@
+"""
+Layout de texto compartilhado pelos conversores TXT, Word e Excel para PDF.
+
+Mede a largura real das fontes do ReportLab (com uma tabela de larguras por
+fonte, preenchida sob demanda), quebra linhas em tempo linear e escreve cada
+página com um único text object em vez de um drawString por linha.
+"""
+
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+ELLIPSIS = "..."
+
+
+class _WidthTable(dict):
+    """Largura de cada caractere em 1/1000 do tamanho da fonte."""
+
+    def __init__(self, font_name):
+        super().__init__()
+        self.font_name = font_name
+
+    def __missing__(self, char):
+        width = self[char] = stringWidth(char, self.font_name, 1000)
+        return width
+
+
+_width_tables = {}
+
+
+def _width_table(font_name):
+    table = _width_tables.get(font_name)
+    if table is None:
+        table = _width_tables[font_name] = _WidthTable(font_name)
+    return table
+
+
+def wrap_text(text, max_width, font_name, font_size):
+    """
+    Quebra o texto em linhas que cabem em max_width pontos. Cada palavra é
+    medida uma única vez; palavras maiores que a linha são quebradas por caractere.
+    """
+    table = _width_table(font_name)
+    limit = max_width * 1000 / font_size
+    measure = table.__getitem__
+
+    # Caso mais comum (ex.: logs): a linha inteira já cabe
+    if sum(map(measure, text)) <= limit:
+        return [text]
+
+    space = table[" "]
+    lines = []
+    current = []
+    current_width = 0.0
+    for word in text.split():
+        word_width = sum(map(measure, word))
+        if current and current_width + space + word_width <= limit:
+            current.append(word)
+            current_width += space + word_width
+            continue
+        if current:
+            lines.append(" ".join(current))
+            current, current_width = [], 0.0
+        if word_width <= limit:
+            current, current_width = [word], word_width
+            continue
+        # Palavra maior que a linha: quebra por caractere
+        chunk_start, chunk_width = 0, 0.0
+        for idx, char in enumerate(word):
+            char_width = measure(char)
+            if chunk_width + char_width > limit and idx > chunk_start:
+                lines.append(word[chunk_start:idx])
+                chunk_start, chunk_width = idx, 0.0
+            chunk_width += char_width
+        current, current_width = [word[chunk_start:]], chunk_width
+    if current:
+        lines.append(" ".join(current))
+    return lines or [""]
+
+
+def truncate_text(text, max_width, font_name, font_size):
+    """Corta o texto com reticências para caber em max_width pontos."""
+    table = _width_table(font_name)
+    limit = max_width * 1000 / font_size
+    if sum(map(table.__getitem__, text)) <= limit:
+        return text
+    limit -= sum(map(table.__getitem__, ELLIPSIS))
+    width = 0.0
+    for idx, char in enumerate(text):
+        width += table[char]
+        if width > limit:
+            return text[:idx] + ELLIPSIS
+    return text
+
+
+class TextWriter:
+    """
+    Escreve linhas de cima para baixo, quebrando página na margem inferior.
+    As linhas de cada página vão para um único text object.
+
+    canvas_factory cria o canvas inicial; com max_pages, o canvas atual é salvo
+    ao atingir esse número de páginas e um novo é pedido à factory (segmentos).
+    """
+
+    def __init__(
+        self,
+        canvas_factory,
+        pagesize=letter,
+        margin=50,
+        font_name="Helvetica",
+        font_size=12,
+        leading=15,
+        max_pages=None,
+    ):
+        self._canvas_factory = canvas_factory
+        self.width, self.height = pagesize
+        self.margin = margin
+        self.font_name = font_name
+        self.font_size = font_size
+        self.leading = leading
+        self.max_pages = max_pages
+
+        self.canvas = canvas_factory()
+        self.pages = 1
+        self.y = self.height - margin
+        self._text = None
+        self._text_font = None
+        self._text_y = None
+
+    @property
+    def max_width(self):
+        return self.width - 2 * self.margin
+
+    def set_font(self, font_name, font_size, leading=None):
+        self.font_name = font_name
+        self.font_size = font_size
+        if leading is not None:
+            self.leading = leading
+
+    def skip(self, points):
+        """Espaço vertical extra antes da próxima linha."""
+        self.y -= points
+
+    def ensure_space(self, points):
+        """Quebra a página se restarem menos de points até a margem inferior."""
+        if self.y < self.margin + points:
+            self.new_page()
+
+    def write_line(self, text):
+        if self.y < self.margin:
+            self.new_page()
+
+        if self._text is None:
+            self._text = self.canvas.beginText(self.margin, self.y)
+            self._text_font = None
+        elif self._text_y != self.y:
+            self._text.setTextOrigin(self.margin, self.y)
+        font = (self.font_name, self.font_size, self.leading)
+        if font != self._text_font:
+            self._text.setFont(*font)
+            self._text_font = font
+
+        self._text.textLine(text)
+        self.y -= self.leading
+        self._text_y = self.y
+
+    def write_wrapped(self, text):
+        for line in wrap_text(text, self.max_width, self.font_name, self.font_size):
+            self.write_line(line)
+
+    def write_truncated(self, text):
+        self.write_line(
+            truncate_text(text, self.max_width, self.font_name, self.font_size)
+        )
+
+    def new_page(self):
+        self._flush()
+        if self.max_pages and self.pages >= self.max_pages:
+            # Descarrega o segmento atual no disco e começa outro
+            self.canvas.save()
+            self.canvas = self._canvas_factory()
+            self.pages = 1
+        else:
+            self.canvas.showPage()
+            self.pages += 1
+        self.y = self.height - self.margin
+
+    def close(self):
+        self._flush()
+        self.canvas.save()
+
+    def _flush(self):
+        if self._text is not None:
+            self.canvas.drawText(self._text)
+            self._text = None
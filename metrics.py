@@ -0,0 +1,195 @@
+"""
+Métricas no formato de texto do Prometheus, sem dependências externas.
+
+Contadores, gauges e histogramas guardam os valores em dicionários por
+combinação de labels, protegidos por um único lock: cada registro é só uma
+soma (e uma busca binária nos histogramas). Os valores são do processo atual.
+"""
+
+import bisect
+import contextvars
+import os
+import threading
+import time
+
+# Limites (segundos) dos histogramas de duração
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_lock = threading.Lock()
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def _header(self):
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+    def render(self):
+        with _lock:
+            items = sorted(self._values.items())
+        lines = self._header()
+        for labels, value in items:
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, labels)} "
+                f"{_format_value(value)}"
+            )
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        # Função chamada na coleta para valores lidos sob demanda (ex.: RSS)
+        self._collect = collect
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with _lock:
+            self._values[labels] = value
+
+    def render(self):
+        if self._collect is not None:
+            value = self._collect()
+            if value is None:
+                return []
+            self.set(value)
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Contagem por faixa (não acumulada), com a faixa +Inf no fim
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def render(self):
+        with _lock:
+            items = sorted(
+                (labels, (list(counts), total))
+                for labels, (counts, total) in self._values.items()
+            )
+        lines = self._header()
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                label_text = _format_labels(
+                    self.labelnames, labels, ("le", _format_value(float(bound)))
+                )
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+def render():
+    """Todas as métricas registradas, no formato de exposição em texto."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def resident_memory_bytes():
+    """RSS atual do processo (Linux); None onde /proc não existe."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def timed_iter(iterable, on_done):
+    """
+    Repassa os itens do iterável medindo só o tempo gasto para produzi-los
+    (sem o tempo de envio entre um item e outro); on_done recebe o total.
+    """
+    iterator = iter(iterable)
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        on_done(elapsed)
+
+
+_pages = contextvars.ContextVar("localpdf_pages", default=None)
+
+
+def track_pages():
+    """Começa a contar as páginas processadas no contexto atual."""
+    counter = [0]
+    _pages.set(counter)
+    return counter
+
+
+def add_pages(count):
+    """Chamado pelos conversores; sem contagem ativa, não faz nada."""
+    counter = _pages.get()
+    if counter is not None:
+        counter[0] += count
@@ -0,0 +1,78 @@
+"""
+Servidor de produção do LocalPDF.io (gunicorn, Linux/macOS).
+
+O app e as bibliotecas pesadas das ferramentas em PRELOAD_TOOLS (PyMuPDF,
+pdf2docx, ReportLab, openpyxl...) são importados uma única vez no processo
+mestre, antes do fork: os workers nascem prontos e compartilham essas páginas
+de memória. Cada worker atende várias requisições em threads e é reciclado
+após SERVER_MAX_REQUESTS requisições ou ao passar de SERVER_MAX_RSS de memória
+residente, terminando antes o que já estava em andamento.
+
+Uso:
+    python server.py
+    LOCALPDF_SERVER_WORKERS=4 LOCALPDF_SERVER_THREADS=8 python server.py
+    LOCALPDF_PRELOAD_TOOLS=split-pdf,merge-pdf python server.py
+"""
+
+from gunicorn.app.base import BaseApplication
+
+import metrics
+from app import app, preload_tools, shutdown_pools
+
+
+def post_request(worker, req, environ, resp):
+    """Marca o worker para reciclagem quando a memória passa do limite."""
+    limit = app.config["SERVER_MAX_RSS"]
+    if not limit or not worker.alive:
+        return
+    rss = metrics.resident_memory_bytes()
+    if rss is not None and rss > limit:
+        worker.log.info(
+            "Worker %s com %d MB de RSS (limite %d MB): reciclando",
+            worker.pid,
+            rss // (1024 * 1024),
+            limit // (1024 * 1024),
+        )
+        # Só sinaliza o loop principal do worker (o poller é dele e não é
+        # thread-safe): ao acordar, em até 1 s, ele para de aceitar conexões,
+        # conclui as que já estavam abertas e sai; o mestre cria outro worker.
+        # É o mesmo caminho que o gunicorn usa ao atingir max_requests
+        worker.alive = False
+
+
+def worker_exit(server, worker):
+    """Espera os jobs assíncronos em execução e encerra os pools do worker."""
+    shutdown_pools()
+
+
+class LocalPDFServer(BaseApplication):
+    def load_config(self):
+        config = app.config
+        settings = {
+            "bind": config["SERVER_BIND"],
+            "workers": config["SERVER_WORKERS"],
+            # gthread mesmo com uma thread: o worker continua enviando
+            # heartbeat ao mestre durante conversões longas
+            "worker_class": "gthread",
+            "threads": config["SERVER_THREADS"],
+            "preload_app": True,
+            "max_requests": config["SERVER_MAX_REQUESTS"],
+            # Evita que todos os workers sejam reciclados ao mesmo tempo
+            "max_requests_jitter": config["SERVER_MAX_REQUESTS"] // 10,
+            "graceful_timeout": config["SERVER_GRACEFUL_TIMEOUT"],
+            "timeout": config["SERVER_TIMEOUT"],
+            "post_request": post_request,
+            "worker_exit": worker_exit,
+            "accesslog": "-",
+        }
+        for key, value in settings.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Com preload_app, roda no mestre antes do fork
+        preload_tools(app.config["PRELOAD_TOOLS"])
+        return app
+
+
+if __name__ == "__main__":
+    LocalPDFServer().run()
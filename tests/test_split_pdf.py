@@ -0,0 +1,79 @@
+"""
+Testes do split-pdf em mode=size.
+
+Uso (na raiz do repositório):
+    python -m pytest tests
+"""
+
+import io
+import os
+import re
+import sys
+import zipfile
+
+import fitz  # PyMuPDF
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "benchmarks"))
+
+import app as localpdf  # noqa: E402
+import corpus  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def text_pdf(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("corpus") / "text_pdf_160.pdf")
+    corpus.text_pdf(path, 160)
+    return path
+
+
+@pytest.fixture(scope="module")
+def scan_pdf(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("corpus") / "scan_pdf_4.pdf")
+    corpus.scan_pdf(path, 4)
+    return path
+
+
+def split_by_size(path, max_mb):
+    """Partes devolvidas por /convert: [(nome, bytes, páginas)], na ordem das páginas."""
+    client = localpdf.app.test_client()
+    with open(path, "rb") as f:
+        response = client.post(
+            "/convert",
+            data={
+                "tool": "split-pdf",
+                "mode": "size",
+                "max_mb": str(max_mb),
+                "files": [(f, os.path.basename(path))],
+            },
+        )
+    assert response.status_code == 200, response.data
+
+    parts = []
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        for name in archive.namelist():
+            data = archive.read(name)
+            with fitz.open(stream=data, filetype="pdf") as doc:
+                # page_3.pdf / pages_1-34.pdf: ordena pela primeira página
+                first_page = int(re.search(r"\d+", name).group())
+                parts.append((first_page, name, len(data), len(doc)))
+    return [part[1:] for part in sorted(parts)]
+
+
+@pytest.mark.parametrize("max_mb", [0.02, 0.05, 0.2])
+def test_partes_cabem_em_max_mb(text_pdf, max_mb):
+    parts = split_by_size(text_pdf, max_mb)
+
+    assert len(parts) > 1
+    for name, size, _ in parts:
+        assert size <= max_mb * 1024 * 1024, f"{name}: {size} bytes"
+    assert sum(pages for _, _, pages in parts) == 160
+
+
+def test_pagina_maior_que_max_mb_fica_sozinha(scan_pdf):
+    # Cada página escaneada tem ~180 KB: não há como cortar abaixo disso
+    parts = split_by_size(scan_pdf, 0.05)
+
+    assert [pages for _, _, pages in parts] == [1, 1, 1, 1]